@@ -0,0 +1,136 @@
+"""
+Micro-benchmark of the normalization helpers in utils on a mix of values resembling
+the rows of a Caspio export: few distinct keywords and jurisdictions repeated across
+many rows, and dates in both supported formats.
+
+Compares the current helpers, with dates parsed once per row, against copies of the
+original helpers, which compiled patterns on each call, were not memoized and parsed
+dates once for the SQL date and again for the year.
+"""
+
+import argparse
+import datetime
+import random
+import re
+import timeit
+
+import utils
+
+_KEYWORDS = [
+    'Cause-Fall from height', 'Cause-Drowning', 'Cause-Overdose', 'Factor-Alcohol', 'Factor-Restraint',
+    'Inquest-Jury recommendations', 'Evidence-Expert witness', 'Evidence General',
+]
+_JURISDICTIONS = ['ON', 'BC', 'AB', 'QC', 'NS', 'UKCOM', 'US', 'CAN']
+_TAGS = ['police', 'hospital', 'youth', 'mental health', 'prison', 'workplace', 'traffic', 'fire']
+
+
+def _original_format_as_id(name):
+    return (
+        name
+            .strip()
+            .upper()
+            .replace('-', '_')
+            .replace(' ', '_')
+            .replace('.', '_')
+            .replace('/', '_')
+    )
+
+
+def _original_format_as_keyword(name):
+    formatted = utils.format_string(name)
+
+    if utils.is_empty_string(name):
+        return formatted
+
+    return formatted[0].upper() + formatted[1:]
+
+
+def _original_format_date(date):
+    if isinstance(date, datetime.datetime):
+        return date
+    elif date is None or date == '':
+        return None
+    elif re.match(r'\d{4}-\d{2}-\d{2}', date) is not None:
+        return date
+    else:
+        match = re.match(r'(\d{1,2})/(\d{1,2})/(\d{4})', date)
+        if match is not None and len(match.groups()) == 3:
+            (month, day, year) = match.groups()
+            return "{}-{}-{}".format(year, month, day)
+        else:
+            raise ValueError('Invalid date: {}'.format(date))
+
+
+def _original_get_year_from_date(date):
+    if isinstance(date, datetime.datetime):
+        return str(date.year)
+    elif date is None or date == '':
+        return None
+    elif re.match(r'\d{4}-\d{2}-\d{2}', date) is not None:
+        return date[:4]
+    elif re.match(r'\d{1,2}/\d{1,2}/\d{4}', date) is not None:
+        return date[-4:]
+    else:
+        raise ValueError('Invalid date: {}'.format(date))
+
+
+def _generate_rows(row_count):
+    rand = random.Random(0)
+    rows = []
+    for _ in range(row_count):
+        year, month, day = rand.randint(1990, 2020), rand.randint(1, 12), rand.randint(1, 28)
+        if rand.random() < 0.5:
+            date = '{}-{:02d}-{:02d}'.format(year, month, day)
+        else:
+            date = '{}/{}/{}'.format(month, day, year)
+        rows.append((
+            rand.sample(_KEYWORDS, 3),
+            rand.choice(_JURISDICTIONS),
+            rand.sample(_TAGS, 2),
+            date,
+        ))
+    return rows
+
+
+def _normalize_rows_original(rows):
+    for keywords, jurisdiction, tags, date in rows:
+        for keyword in keywords:
+            _original_format_as_id(keyword)
+        _original_format_as_id(jurisdiction)
+        for tag in tags:
+            _original_format_as_keyword(tag)
+        _original_format_date(date)
+        _original_get_year_from_date(date)
+
+
+def _normalize_rows(rows):
+    for keywords, jurisdiction, tags, date in rows:
+        for keyword in keywords:
+            utils.format_as_id(keyword)
+        utils.format_as_id(jurisdiction)
+        for tag in tags:
+            utils.format_as_keyword(tag)
+        utils.parse_date(date)
+
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000, help='Number of rows to normalize')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs; the fastest is reported')
+    args = parser.parse_args()
+
+    rows = _generate_rows(args.rows)
+
+    original_seconds = min(timeit.repeat(lambda: _normalize_rows_original(rows), number=1, repeat=args.repeat))
+    current_seconds = min(timeit.repeat(lambda: _normalize_rows(rows), number=1, repeat=args.repeat))
+
+    print('Rows:     {} ({} distinct dates)'.format(args.rows, len({row[3] for row in rows})))
+    print('Original: {:.3f}s ({:.0f} rows/s)'.format(original_seconds, args.rows / original_seconds))
+    print('Current:  {:.3f}s ({:.0f} rows/s)'.format(current_seconds, args.rows / current_seconds))
+    print('Speedup:  {:.1f}x'.format(original_seconds / current_seconds))
+    for function in [utils.format_as_id, utils.format_as_keyword]:
+        print('{}: {}'.format(function.__name__, function.cache_info()))
+
+
+if __name__ == '__main__':
+    _main()
@@ -4,9 +4,13 @@ from sqlalchemy.orm import sessionmaker
 
 class DatabaseClient:
 
-    def __init__(self, db_url):
-        engine = create_engine(db_url)
-        self._session_maker = sessionmaker(bind=engine)
+    def __init__(self, db_url, local_infile=False):
+        # LOAD DATA LOCAL INFILE must be explicitly allowed by the client.
+        self._engine = create_engine(db_url, connect_args={'local_infile': True} if local_infile else {})
+        self._session_maker = sessionmaker(bind=self._engine)
+
+    def get_engine(self):
+        return self._engine
 
     def get_session(self):
         return self._session_maker()
@@ -0,0 +1,169 @@
+import datetime
+
+import sqlalchemy
+
+import models
+from logger import logger
+
+# Models written by the migrator, in the order in which FK constraints are satisfied.
+MIGRATED_MODELS = [
+    models.Source,
+    models.AuthorityKeyword,
+    models.AuthorityKeywordSynonyms,
+    models.DeathCause,
+    models.InquestKeyword,
+    models.InquestKeywordSynonyms,
+    models.Authority,
+    models.AuthorityKeywords,
+    models.AuthorityTags,
+    models.Inquest,
+    models.Deceased,
+    models.InquestKeywords,
+    models.InquestTags,
+    models.AuthorityCitations,
+    models.AuthorityRelated,
+    models.AuthorityInquests,
+    models.DocumentSource,
+    models.AuthorityDocument,
+    models.AuthorityDocumentLinks,
+    models.InquestDocument,
+    models.InquestDocumentLinks,
+]
+
+
+class DeltaWriter:
+    """
+    Collects rows of every migrated model and applies only the difference between them and the rows currently in
+    the database, as INSERT, UPDATE and DELETE statements.
+    """
+
+    # Rows are matched by primary key, except for models whose primary key is assigned by the database.
+    _NATURAL_KEYS = {
+        models.Deceased: ('inquestId',),
+    }
+
+    def __init__(self, batch_size):
+        self._batch_size = batch_size
+
+        # Mapping from model to its rows, keyed by the columns rows are matched by.
+        self._rows = {model: {} for model in MIGRATED_MODELS}
+        self._columns = {}
+
+    def add(self, model, **values):
+        """Collect row for given model; all rows of a model must set the same columns."""
+        columns = self._columns.setdefault(model, tuple(values))
+        assert tuple(values) == columns, 'Rows of {} must set the same columns.'.format(model.__tablename__)
+
+        # Rows with the same key are rejected like the primary key rejects them when rows are inserted.
+        key = tuple(values[column] for column in self._get_key_columns(model))
+        if key in self._rows[model]:
+            raise ValueError('Table: {} has duplicate key: {}.'.format(model.__tablename__, key))
+        self._rows[model][key] = values
+
+    def flush(self):
+        """Rows are only applied once every phase has added its rows; see apply."""
+
+    def apply(self, session):
+        """Apply difference between collected rows and rows in the database within given session."""
+        changes = {model: self._diff(session, model) for model in MIGRATED_MODELS}
+
+        # Delete rows before any are inserted, since rows may be replaced by rows with a case-insensitively equal
+        # key, and delete referencing rows before the rows they reference.
+        for model in reversed(MIGRATED_MODELS):
+            table = model.__table__  # pylint: disable=no-member
+            deleted_keys = changes[model][2]
+            key_columns = self._get_key_columns(model)
+            statement = table.delete().where(sqlalchemy.and_(*[
+                table.c[column] == sqlalchemy.bindparam('key_{}'.format(column))
+                for column in key_columns
+            ]))
+            self._execute_in_batches(session, statement, [
+                {'key_{}'.format(column): value for column, value in zip(key_columns, key)}
+                for key in deleted_keys
+            ])
+
+        for model in MIGRATED_MODELS:
+            table = model.__table__  # pylint: disable=no-member
+            inserted_rows, updated_rows, deleted_keys = changes[model]
+            key_columns = self._get_key_columns(model)
+
+            if updated_rows:
+                value_columns = [column for column in self._columns[model] if column not in key_columns]
+                statement = table.update().where(sqlalchemy.and_(*[
+                    table.c[column] == sqlalchemy.bindparam('key_{}'.format(column))
+                    for column in key_columns
+                ])).values({
+                    column: sqlalchemy.bindparam('value_{}'.format(column))
+                    for column in value_columns
+                })
+                self._execute_in_batches(session, statement, [
+                    dict(
+                        [('key_{}'.format(column), row[column]) for column in key_columns] +
+                        [('value_{}'.format(column), row[column]) for column in value_columns]
+                    )
+                    for row in updated_rows
+                ])
+
+            self._execute_in_batches(session, table.insert(), inserted_rows)
+
+            if inserted_rows or updated_rows or deleted_keys:
+                logger.info(
+                    'Table: %s has %d inserted, %d updated and %d deleted rows.',
+                    model.__tablename__, len(inserted_rows), len(updated_rows), len(deleted_keys)
+                )
+
+    def _diff(self, session, model):
+        """Return tuple of rows to insert, rows to update and keys of rows to delete for given model."""
+        table = model.__table__
+        key_columns = self._get_key_columns(model)
+        value_columns = [column for column in self._columns.get(model, ()) if column not in key_columns]
+
+        existing_rows = {}
+        query = sqlalchemy.select([table.c[column] for column in key_columns + tuple(value_columns)])
+        for row in session.execute(query):
+            key = tuple(self._normalize(table.c[column], value) for column, value in zip(key_columns, row))
+            existing_rows[key] = tuple(
+                self._normalize(table.c[column], value)
+                for column, value in zip(value_columns, row[len(key_columns):])
+            )
+
+        inserted_rows = []
+        updated_rows = []
+        incoming_keys = set()
+        for key, row in self._rows[model].items():
+            key = tuple(self._normalize(table.c[column], value) for column, value in zip(key_columns, key))
+            incoming_keys.add(key)
+            if key not in existing_rows:
+                inserted_rows.append(row)
+            elif existing_rows[key] != tuple(self._normalize(table.c[column], row[column]) for column in value_columns):
+                updated_rows.append(row)
+
+        deleted_keys = [key for key in existing_rows if key not in incoming_keys]
+
+        return inserted_rows, updated_rows, deleted_keys
+
+    def _get_key_columns(self, model):
+        if model in self._NATURAL_KEYS:
+            return self._NATURAL_KEYS[model]
+        return tuple(column.name for column in model.__table__.primary_key.columns)
+
+    def _normalize(self, column, value):
+        """Convert given value to the form in which it is read back from given column."""
+        if value is None:
+            return None
+        if isinstance(column.type, sqlalchemy.Date):
+            if isinstance(value, datetime.datetime):
+                return value.date()
+            if isinstance(value, str):
+                return datetime.date(*[int(part) for part in value.split('-')])
+            return value
+        if isinstance(column.type, sqlalchemy.Integer):
+            return int(value)
+        if isinstance(column.type, sqlalchemy.CHAR):
+            # MySQL removes trailing spaces from CHAR values when they are read.
+            return value.rstrip(' ')
+        return value
+
+    def _execute_in_batches(self, session, statement, rows):
+        for start in range(0, len(rows), self._batch_size):
+            session.execute(statement, rows[start:start + self._batch_size])
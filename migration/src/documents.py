@@ -0,0 +1,47 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import logger
+
+DocumentFile = collections.namedtuple('DocumentFile', ['path', 'size', 'mtime_ns'])
+
+
+class DocumentFileIndex:
+    """Index from document serial to the files in its directory, built with a single walk of the documents."""
+
+    # Directories are listed concurrently since each listing is a round-trip on network mounts.
+    _MAX_WORKERS = 8
+
+    def __init__(self, directory):
+        self._files = {}
+
+        if not os.path.isdir(directory):
+            return
+
+        with os.scandir(directory) as entries:
+            document_directories = [entry for entry in entries if entry.is_dir()]
+
+        with ThreadPoolExecutor(max_workers=self._MAX_WORKERS) as executor:
+            for entry, files in zip(document_directories, executor.map(self._list_files, document_directories)):
+                self._files[entry.name] = files
+
+    def __len__(self):
+        return len(self._files)
+
+    def get_files(self, serial):
+        """Return list of files in directory of document with given serial."""
+        return self._files.get(serial.strip(), [])
+
+    def _list_files(self, document_directory):
+        files = []
+        with os.scandir(document_directory.path) as entries:
+            for entry in entries:
+                # Follows symlinks, so that linked documents are uploaded with the size of their target.
+                try:
+                    stat_result = entry.stat()
+                except OSError as error:
+                    logger.warning('Document file: %s cannot be read: %s', entry.path, error)
+                    continue
+                files.append(DocumentFile(entry.path, stat_result.st_size, stat_result.st_mtime_ns))
+        return files
@@ -1,8 +1,14 @@
 import datetime
 import logging
 
+logger = logging.getLogger('migration')
 
-def _init_logger():
+
+def init_logger():
+    """
+    Log to the console and to files in ./logs. Only called by the entry point, since worker processes which import
+    this module must not reopen, and thereby truncate, the log files of the run.
+    """
     log_debug_file = './logs/{}.txt'.format(datetime.datetime.now().strftime('%Y-%m-%d'))
     log_warning_file = './logs/{}-warnings.txt'.format(datetime.datetime.now().strftime('%Y-%m-%d'))
 
@@ -19,12 +25,18 @@ def _init_logger():
     warning_file_handler = logging.FileHandler(log_warning_file, mode='w')
     warning_file_handler.setLevel(logging.WARNING)
 
-    migration_logger = logging.getLogger('migration')
-    migration_logger.setLevel(logging.DEBUG)
-    migration_logger.addHandler(debug_file_handler)
-    migration_logger.addHandler(debug_stream_handler)
-    migration_logger.addHandler(warning_file_handler)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(debug_file_handler)
+    logger.addHandler(debug_stream_handler)
+    logger.addHandler(warning_file_handler)
+
+
+class WarningCounter(logging.Handler):
+    """Counts the warnings logged while it is added to a logger."""
 
-    return migration_logger
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
 
-logger = _init_logger()
+    def emit(self, record):
+        self.count += 1
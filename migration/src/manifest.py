@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+
+
+class UploadManifest:
+    """Local record of uploaded documents, used to skip unchanged files without any S3 requests."""
+
+    def __init__(self, path):
+        # The connection is shared by the upload threads; all access is serialized by the lock.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    etag TEXT NOT NULL,
+                    sha256 TEXT NOT NULL
+                )
+            """)
+
+    def is_unchanged(self, key, document_file):
+        """Return True if given document file was uploaded under given key and has not been modified since."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT path, mtime, size FROM uploads WHERE key = ?',
+                (key,)
+            ).fetchone()
+
+        return row is not None and row == (document_file.path, document_file.mtime_ns, document_file.size)
+
+    def record(self, key, document_file, file_hashes):
+        """Record that given document file is stored in S3 under given key."""
+        etag, sha256 = file_hashes
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO uploads (key, path, mtime, size, etag, sha256) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, document_file.path, document_file.mtime_ns, document_file.size, etag, sha256)
+            )
+
+    def reconcile(self, remote_objects):
+        """
+        Remove entries which do not match given mapping from key to (size, ETag) of objects in S3, so that their
+        documents are uploaded again. Returns tuple of counts of missing and mismatched entries.
+        """
+        missing_keys = []
+        mismatched_keys = []
+
+        with self._lock, self._connection:
+            for key, size, etag in self._connection.execute('SELECT key, size, etag FROM uploads').fetchall():
+                if key not in remote_objects:
+                    missing_keys.append(key)
+                elif remote_objects[key] != (size, etag):
+                    mismatched_keys.append(key)
+
+            self._connection.executemany(
+                'DELETE FROM uploads WHERE key = ?',
+                [(key,) for key in missing_keys + mismatched_keys]
+            )
+
+        return len(missing_keys), len(mismatched_keys)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,160 @@
+import collections
+import contextlib
+import copy
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import sqlalchemy
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then not reported.
+    resource = None
+
+
+class RunMetrics:
+    """
+    Collects timings and counters of each phase of a migration run, and writes them as a JSON summary and optionally
+    as a Prometheus textfile, so that runs can be compared against each other.
+    """
+
+    def __init__(self):
+        self._start_time = time.monotonic()
+        self._started = datetime.datetime.now()
+
+        # Database events arrive from writer threads, so counters are only updated under the lock.
+        self._lock = threading.Lock()
+        self._phases = collections.OrderedDict()
+        self._current_phase = None
+        self._s3_seconds = 0.0
+
+    def attach(self, engine):
+        """Count statements executed by given engine towards the current phase."""
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a phase; counters recorded meanwhile are attributed to it."""
+        with self._lock:
+            self._current_phase = self._get_phase(name)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases[name]['seconds'] += time.monotonic() - start_time
+                self._current_phase = None
+
+    def record_stages(self, stage_seconds, table_row_counts):
+        """Record seconds spent per pipeline stage and rows written per table in the current phase."""
+        with self._lock:
+            phase = self._current_phase or self._get_phase('other')
+            for stage, seconds in stage_seconds.items():
+                phase['stage_seconds'][stage] = phase['stage_seconds'].get(stage, 0.0) + seconds
+            for table, count in table_row_counts.items():
+                phase['rows'][table] = phase['rows'].get(table, 0) + count
+
+    def record_s3_seconds(self, seconds):
+        """Record seconds spent in S3 requests, which may overlap with other phases."""
+        with self._lock:
+            self._s3_seconds += seconds
+
+    def get_summary(self):
+        with self._lock:
+            rows = collections.Counter()
+            for phase in self._phases.values():
+                rows.update(phase['rows'])
+
+            return {
+                'started': self._started.isoformat(),
+                'seconds': time.monotonic() - self._start_time,
+                'peak_rss_bytes': self._get_peak_rss_bytes(),
+                's3_seconds': self._s3_seconds,
+                'round_trips': sum(phase['round_trips'] for phase in self._phases.values()),
+                'flushes': sum(phase['flushes'] for phase in self._phases.values()),
+                'rows': dict(rows),
+                'phases': copy.deepcopy(self._phases),
+            }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as json_file:
+            json.dump(self.get_summary(), json_file, indent=2)
+
+    def write_prometheus(self, path):
+        """Write summary in the Prometheus text format, for the textfile collector of the node exporter."""
+        summary = self.get_summary()
+
+        lines = [
+            '# TYPE migration_last_run_timestamp_seconds gauge',
+            'migration_last_run_timestamp_seconds {}'.format(time.time()),
+            '# TYPE migration_run_seconds gauge',
+            'migration_run_seconds {}'.format(summary['seconds']),
+            '# TYPE migration_s3_seconds gauge',
+            'migration_s3_seconds {}'.format(summary['s3_seconds']),
+            '# TYPE migration_phase_seconds gauge',
+        ]
+        lines.extend(
+            'migration_phase_seconds{{phase="{}"}} {}'.format(name, phase['seconds'])
+            for name, phase in summary['phases'].items()
+        )
+        lines.append('# TYPE migration_phase_stage_seconds gauge')
+        lines.extend(
+            'migration_phase_stage_seconds{{phase="{}",stage="{}"}} {}'.format(name, stage, seconds)
+            for name, phase in summary['phases'].items()
+            for stage, seconds in phase['stage_seconds'].items()
+        )
+        lines.append('# TYPE migration_phase_round_trips gauge')
+        lines.extend(
+            'migration_phase_round_trips{{phase="{}"}} {}'.format(name, phase['round_trips'])
+            for name, phase in summary['phases'].items()
+        )
+        lines.append('# TYPE migration_phase_flushes gauge')
+        lines.extend(
+            'migration_phase_flushes{{phase="{}"}} {}'.format(name, phase['flushes'])
+            for name, phase in summary['phases'].items()
+        )
+        lines.append('# TYPE migration_table_rows gauge')
+        lines.extend(
+            'migration_table_rows{{table="{}"}} {}'.format(table, count)
+            for table, count in sorted(summary['rows'].items())
+        )
+        if summary['peak_rss_bytes'] is not None:
+            lines.append('# TYPE migration_peak_rss_bytes gauge')
+            lines.append('migration_peak_rss_bytes {}'.format(summary['peak_rss_bytes']))
+
+        # Write to a temporary file first so that the collector never reads a partial file.
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as textfile:
+            textfile.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+
+    def _get_phase(self, name):
+        if name not in self._phases:
+            self._phases[name] = {
+                'seconds': 0.0,
+                'stage_seconds': {},
+                'round_trips': 0,
+                'flushes': 0,
+                'rows': {},
+            }
+        return self._phases[name]
+
+    def _on_execute(self, _conn, _cursor, statement, _parameters, _context, executemany):
+        with self._lock:
+            phase = self._current_phase or self._get_phase('other')
+            phase['round_trips'] += 1
+            # Batched writes are sent as a single executemany or LOAD DATA statement each.
+            if executemany or statement.lstrip().upper().startswith('LOAD DATA'):
+                phase['flushes'] += 1
+
+    def _get_peak_rss_bytes(self):
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS but in kilobytes elsewhere.
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
@@ -1,14 +1,36 @@
-import os
+import contextlib
+import datetime
+import functools
 import re
 
-import sqlalchemy
-from openpyxl import load_workbook
-
 import models
 import utils
 from db import DatabaseClient
-from logger import logger
+from delta import DeltaWriter
+from documents import DocumentFileIndex
+from logger import WarningCounter, logger
+from manifest import UploadManifest
+from metrics import RunMetrics
+from pipeline import Pipeline
+from profiling import Profiler
+from registry import AuthorityRecord, AuthorityRegistry
 from s3 import S3Client
+from uploader import DocumentUploader
+from validation import RULES, MemoryValidator, Validator
+from workbook import WorkbookReader
+from writer import BulkWriter, InfileWriter
+
+
+def _phase(name):
+    """Decorator running a Migrator method as given phase of the run, for metrics and profiling."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # The decorator is part of the class, so it may use the class's protected members.
+            with self._run_phase(name):  # pylint: disable=protected-access
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class Migrator:
@@ -16,25 +38,130 @@ class Migrator:
     _AUTHORITY_TYPE_AUTHORITY = 'Authority'
     _AUTHORITY_TYPE_INQUEST = 'Inquest/Fatality Inquiry'
 
-    def __init__(self, data_directory, document_files_directory, db_url, upload_documents):
+    _AUTHORITY_KEYWORD_CATEGORIES = {
+        'EVIDENCE',
+        'FACTOR',
+        'INQUEST',
+    }
+    _INQUEST_KEYWORD_CATEGORIES = {
+        'CAUSE',
+        'FACTOR',
+        'INQUEST',
+    }
+
+    # Authorities are inserted in order of their export ID, which also orders the IDs of deceased.
+    _AUTHORITY_EXPORT_ID_COLUMN = -8
+
+    _TAG_SEPARATOR_PATTERN = re.compile(r'[,\n]')
+
+    # Number of chunks of rows buffered between pipeline stages.
+    _PIPELINE_QUEUE_SIZE = 100
+
+    _WORKBOOKS = ['source', 'keywords', 'authorities', 'docs']
+
+    _S3_DOCUMENTS_PREFIX = 'Documents/'
+    _UPLOAD_MANIFEST_PATH = './logs/upload-manifest.sqlite'
+    _METRICS_PATH = './logs/{}-metrics.json'
+
+    # Rows are either inserted in batches or spooled to TSV files and bulk loaded.
+    LOAD_MODE_INSERT = 'insert'
+    LOAD_MODE_INFILE = 'infile'
+
+    def __init__(
+            self, data_directory, document_files_directory, db_url, upload_documents, upload_workers, batch_size,
+            load_mode, incremental, metrics_textfile=None, profile_mode=None
+        ):
         self._data_directory = data_directory
         self._document_files_directory = document_files_directory
+        self._db_url = db_url
         self._upload_documents = upload_documents
-        self._db_client = DatabaseClient(db_url)
-        self._s3_client = S3Client(bucket='inquests-ca-resources')
+        self._upload_workers = upload_workers
+        self._batch_size = batch_size
+        self._load_mode = load_mode
+        self._metrics_textfile = metrics_textfile
+
+        # In incremental mode, rows of all phases are collected by a single writer and only changes are applied.
+        self._delta_writer = DeltaWriter(batch_size) if incremental else None
+        self._metrics = RunMetrics()
+        self._profiler = Profiler(profile_mode) if profile_mode is not None else None
+        self._workbook_reader = WorkbookReader(data_directory)
+        self._validator = Validator(RULES)
+        self._document_files = None
+
+        # Clients are created once first used, so that checking the workbooks needs neither a database nor AWS.
+        self._db_client = None
+        self._s3_client = None
+        self._upload_manifest = None
+        self._uploader = None
+
+        # When only checking, rows are passed to this instead of being written to the database.
+        self._row_checker = None
 
         # Sets of authority and inquest keywords.
         self._authority_keyword_ids = set()
         self._inquest_keyword_ids = set()
 
-        # Mappings from authority serial to various attributes.
-        self._authority_serial_to_id = {}
-        self._authority_serial_to_related = {}          # Tuple of related authorities and cited authorities.
-        self._authority_serial_to_type = {}             # Type being either authority or inquest.
-        self._authority_serial_to_name = {}
-        self._authority_serial_to_primary_document = {}
+        # Records of authorities and inquests by serial.
+        self._authorities = AuthorityRegistry()
 
     def run(self):
+        if self._profiler is not None:
+            self._profiler.start()
+        try:
+            self._run_phases()
+        finally:
+            self._close_uploads()
+            if self._profiler is not None:
+                self._profiler.close()
+            self._write_metrics()
+
+    def _run_phases(self):
+        if self._upload_documents:
+            self._upload_manifest = UploadManifest(self._UPLOAD_MANIFEST_PATH)
+            self._uploader = DocumentUploader(
+                self._get_s3_client(), self._upload_manifest, self._upload_workers, self._metrics
+            )
+
+            # Index uploaded documents up front so that checking whether a document exists needs no requests.
+            with self._run_phase('index'):
+                object_count = self._get_s3_client().build_index(self._S3_DOCUMENTS_PREFIX)
+            logger.info('Indexed %d documents in S3.', object_count)
+
+        # The workbooks are independent, so they are parsed concurrently before being used in dependency order.
+        with self._run_phase('parse'):
+            self._workbook_reader.prefetch(self._WORKBOOKS)
+
+        self._populate()
+
+        if self._delta_writer is not None:
+            self.apply_delta()
+
+        # Run checks to ensure data is valid.
+        self.validate()
+
+        # Uploads run in the background while the database is populated, so they may still be in progress.
+        if self._uploader is not None:
+            with self._run_phase('uploads'):
+                failures = self._uploader.wait()
+            if failures:
+                raise RuntimeError('{} documents failed to upload.'.format(len(failures)))
+
+    def _close_uploads(self):
+        # Uploads still queued when a phase fails are cancelled, since the workers would otherwise keep the process
+        # alive until every upload is done.
+        if self._uploader is not None:
+            self._uploader.cancel()
+            self._upload_manifest.close()
+            self._uploader = None
+            self._upload_manifest = None
+
+    def _populate(self):
+        # Workbooks are checked before they are migrated, so every pass over them starts from scratch.
+        self._authority_keyword_ids = set()
+        self._inquest_keyword_ids = set()
+        self._authorities = AuthorityRegistry()
+        self._document_files = None
+
         # These operations must be done first to satisfy FK constraints.
         self.populate_sources()
         self.populate_keywords()
@@ -46,16 +173,125 @@ class Migrator:
         self.populate_authority_relationships()
         self.populate_documents()
 
-        # Run checks to ensure data is valid.
-        self.validate()
+    @contextlib.contextmanager
+    def _run_phase(self, name):
+        """Attribute metrics and profiles of the enclosed block to given phase."""
+        # A check is measured as a single phase of its own, so that it does not add to the phases it runs.
+        if self._row_checker is not None:
+            yield
+            return
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self._metrics.phase(name))
+            if self._profiler is not None:
+                stack.enter_context(self._profiler.phase(name))
+            yield
+
+    def _write_metrics(self):
+        metrics_path = self._METRICS_PATH.format(datetime.datetime.now().strftime('%Y-%m-%d'))
+        self._metrics.write_json(metrics_path)
+        logger.info('Metrics written to: %s', metrics_path)
+
+        if self._metrics_textfile is not None:
+            self._metrics.write_prometheus(self._metrics_textfile)
+
+    def verify_manifest(self):
+        """Remove upload manifest entries which do not match the documents in S3, so that they are uploaded again."""
+        logger.info('Verifying upload manifest.')
+
+        manifest = UploadManifest(self._UPLOAD_MANIFEST_PATH)
+        s3_objects = self._get_s3_client().list_objects(self._S3_DOCUMENTS_PREFIX)
+        missing_count, mismatched_count = manifest.reconcile(s3_objects)
+        manifest.close()
+
+        logger.info(
+            'Upload manifest had %d documents missing from S3 and %d documents which differ from S3.',
+            missing_count, mismatched_count
+        )
+
+    def check(self):
+        """
+        Check the rows of all workbooks without a database, by running every populate phase with rows passed to a
+        validator which evaluates the validation rules in memory. Returns number of problems, each logged as a warning.
+        """
+        logger.info('Checking workbooks.')
+
+        if self._document_files_directory is None:
+            logger.info('No documents directory given; files of documents are not checked.')
+
+        warning_counter = WarningCounter()
+        with self._metrics.phase('check'):
+            self._row_checker = MemoryValidator(RULES)
+            logger.addHandler(warning_counter)
+            try:
+                self._workbook_reader.prefetch(self._WORKBOOKS)
+                self._populate()
+                self._row_checker.validate(self._get_labels())
+            finally:
+                logger.removeHandler(warning_counter)
+                self._row_checker = None
+
+        logger.info('Check found %d problems.', warning_counter.count)
+
+        return warning_counter.count
+
+    def _get_db_client(self):
+        if self._db_client is None:
+            self._db_client = DatabaseClient(self._db_url, local_infile=self._load_mode == self.LOAD_MODE_INFILE)
+            self._metrics.attach(self._db_client.get_engine())
+        return self._db_client
+
+    def _get_s3_client(self):
+        if self._s3_client is None:
+            self._s3_client = S3Client(bucket='inquests-ca-resources')
+        return self._s3_client
 
     def _read_workbook(self, workbook):
         """Returns iterator for rows in given Excel file."""
-        work_book = load_workbook(os.path.join(self._data_directory, 'caspio_{}.xlsx'.format(workbook)))
-        work_sheet = work_book.active
+        return self._workbook_reader.read(workbook)
+
+    def _read_authorities_by_export_id(self):
+        """Returns iterator for rows of the authorities workbook in order of export ID."""
+        # Exports are normally ordered already, in which case a cheap first pass avoids holding every row in memory.
+        previous_export_id = None
+        for row in self._read_workbook('authorities'):
+            export_id = row[self._AUTHORITY_EXPORT_ID_COLUMN]
+            if previous_export_id is not None and export_id < previous_export_id:
+                logger.debug('Workbook: authorities is not ordered by export ID and will be sorted in memory.')
+                return iter(sorted(
+                    self._read_workbook('authorities'),
+                    key=lambda row: row[self._AUTHORITY_EXPORT_ID_COLUMN]
+                ))
+            previous_export_id = export_id
+
+        return self._read_workbook('authorities')
+
+    def _create_pipeline(self, name):
+        # Rows passed to a check are not written, so they are not counted in the metrics of the run.
+        return Pipeline(name, self._PIPELINE_QUEUE_SIZE, self._metrics if self._row_checker is None else None)
+
+    def _open_writer(self, pipeline):
+        """Returns session and writer for the rows of a populate phase; there is no session when only checking."""
+        if self._row_checker is not None:
+            return None, pipeline.write(self._row_checker)
 
-        # Start at 2nd row to ignore headers.
-        return work_sheet.iter_rows(min_row=2, values_only=True)
+        session = self._get_db_client().get_session()
+        return session, pipeline.write(self._get_writer(session))
+
+    def _close_writer(self, pipeline, session, writer):
+        writer.flush()
+        # Stages are only timed up to the flush; the commit is attributed to the phase as a whole.
+        pipeline.log()
+        if session is not None:
+            session.commit()
+
+    def _get_writer(self, session):
+        """Returns writer which batches inserts within given session."""
+        if self._delta_writer is not None:
+            return self._delta_writer
+        if self._load_mode == self.LOAD_MODE_INFILE:
+            return InfileWriter(session)
+        return BulkWriter(session, self._batch_size)
 
     def _is_valid_authority_type(self, authority_type):
         return authority_type in [self._AUTHORITY_TYPE_AUTHORITY, self._AUTHORITY_TYPE_INQUEST]
@@ -107,53 +343,50 @@ class Migrator:
 
         return utils.format_string(keyword_split[1])
 
-    def _upload_document_if_exists(self, name, date, source, serial, authority_serial):
-        """Upload document file to S3 if one exists locally."""
-        # Get file path.
-        directory = os.path.join(self._document_files_directory, serial.strip())
-        documents = list(os.scandir(directory)) if os.path.isdir(directory) else []
+    def _upload_document_if_exists(self, name, year, source, serial, authority_serial):
+        """Queue upload of document file to S3 if one exists locally."""
+        if self._document_files is None:
+            return None
+
+        documents = self._document_files.get_files(serial)
 
         # Ensure there is exactly one file per document directory.
         if len(documents) != 1:
             logger.warning('Document: %s has %d files.', serial, len(documents))
             return None
 
-        file_path = documents[0].path
+        document_file = documents[0]
+
+        # Checks only need to know whether the file exists.
+        if self._row_checker is not None:
+            return None
 
-        year = utils.get_year_from_date(date)
         source_id = self._source_serial_to_id(source)
 
         # Generate S3 key for the given document with the form:
         # Documents/<source>/<year>/<authority name>/<document name>
-        authority_name = self._authority_serial_to_name[authority_serial]
-        key = self._s3_client.generate_s3_key(
+        authority_name = self._authorities[authority_serial].name
+        key = self._get_s3_client().generate_s3_key(
             ['Documents', source_id, year, authority_name, name],
             'pdf'
         )
 
-        link = self._s3_client.generate_object_url(key)
+        link = self._get_s3_client().generate_object_url(key)
 
-        if not self._upload_documents:
-            return link
-
-        # Check if file exists to avoid unnecessary writes.
-        if self._s3_client.object_exists(key):
-            logger.debug(
-                'Document: %s will not be uploaded since one already exists.',
-                serial
-            )
-        else:
-            self._s3_client.upload_pdf(file_path, key)
-            logger.debug('Document: %s successfully uploaded to: %s', serial, link)
+        # The link only depends on the key, so it can be returned before the upload completes.
+        if self._upload_documents:
+            self._uploader.submit(serial, document_file, key)
 
         return link
 
+    @_phase('sources')
     def populate_sources(self):
         logger.info('Populating sources.')
 
-        session = self._db_client.get_session()
+        pipeline = self._create_pipeline('sources')
+        session, writer = self._open_writer(pipeline)
 
-        for row in self._read_workbook('source'):
+        for row in pipeline.read(self._read_workbook('source')):
             rcode, rdescription, rjurisdiction, _, rrank = row
 
             if rcode.endswith('OTH'):
@@ -175,34 +408,25 @@ class Migrator:
 
             rank = int((rrank.split('-', 1)[0]).strip())
 
-            session.add(models.Source(
+            writer.add(
+                models.Source,
                 sourceId=utils.format_as_id(source_id),
                 jurisdictionId=jurisdiction_id,
                 name=utils.format_string(rdescription),
                 code=utils.format_as_id(code),
                 rank=rank
-            ))
-            session.flush()
+            )
 
-        session.commit()
+        self._close_writer(pipeline, session, writer)
 
+    @_phase('keywords')
     def populate_keywords(self):
         logger.info('Populating keywords.')
 
-        session = self._db_client.get_session()
+        pipeline = self._create_pipeline('keywords')
+        session, writer = self._open_writer(pipeline)
 
-        authority_categories = {
-            'EVIDENCE',
-            'FACTOR',
-            'INQUEST',
-        }
-        inquest_categories = {
-            'CAUSE',
-            'FACTOR',
-            'INQUEST',
-        }
-
-        for row in self._read_workbook('keywords'):
+        for row in pipeline.read(self._read_workbook('keywords')):
             rtype, rkeyword, _, rdescription, rsynonyms = row
 
             if not self._is_valid_authority_type(rtype):
@@ -215,6 +439,10 @@ class Migrator:
             elif rkeyword == 'Evidence General':
                 # Special case where - is not used.
                 category_id = 'EVIDENCE'
+            else:
+                # Keywords without a category are reported and skipped below, rather than taking the category of the
+                # previous keyword.
+                category_id = None
 
             keyword_id = self._keyword_serial_to_id(rkeyword)
             if keyword_id is None:
@@ -226,28 +454,29 @@ class Migrator:
             synonyms = rsynonyms.split(',') if not utils.is_empty_string(rsynonyms) else []
 
             if rtype == self._AUTHORITY_TYPE_AUTHORITY:
-                if category_id not in authority_categories:
+                if category_id not in self._AUTHORITY_KEYWORD_CATEGORIES:
                     logger.warning(
                         'Keyword: "%s" has invalid authority category: "%s".',
                         rkeyword, category_id
                     )
                     continue
                 self._authority_keyword_ids.add(keyword_id)
-                session.add(models.AuthorityKeyword(
+                writer.add(
+                    models.AuthorityKeyword,
                     authorityKeywordId=keyword_id,
                     authorityCategoryId=category_id,
                     name=utils.format_string(keyword_name),
                     description=utils.format_string(rdescription),
-                ))
-                session.flush()
+                )
                 for synonym in synonyms:
                     if not utils.is_empty_string(synonym):
-                        session.add(models.AuthorityKeywordSynonyms(
+                        writer.add(
+                            models.AuthorityKeywordSynonyms,
                             authorityKeywordId=keyword_id,
                             synonym=utils.format_as_keyword(synonym),
-                        ))
+                        )
             else:
-                if category_id not in inquest_categories:
+                if category_id not in self._INQUEST_KEYWORD_CATEGORIES:
                     logger.warning(
                         'Keyword: "%s" has invalid inquest category: "%s".',
                         rkeyword, category_id
@@ -258,35 +487,38 @@ class Migrator:
                 # Note that deathCause is a property of the deceased, not an inquest keyword.
                 death_cause = self._keyword_serial_to_death_cause(rkeyword)
                 if death_cause:
-                    session.add(models.DeathCause(
+                    writer.add(
+                        models.DeathCause,
                         deathCauseId=utils.format_as_id(death_cause),
                         name=utils.format_string(death_cause),
                         description=utils.format_string(rdescription),
-                    ))
+                    )
                 else:
-                    session.add(models.InquestKeyword(
+                    writer.add(
+                        models.InquestKeyword,
                         inquestKeywordId=keyword_id,
                         inquestCategoryId=category_id,
                         name=utils.format_string(keyword_name),
                         description=utils.format_string(rdescription),
-                    ))
-                    session.flush()
+                    )
                     for synonym in synonyms:
                         if not utils.is_empty_string(synonym):
-                            session.add(models.InquestKeywordSynonyms(
+                            writer.add(
+                                models.InquestKeywordSynonyms,
                                 inquestKeywordId=keyword_id,
                                 synonym=utils.format_as_keyword(synonym),
-                            ))
+                            )
 
-        session.commit()
+        self._close_writer(pipeline, session, writer)
 
+    @_phase('authorities')
     def populate_authorities_and_inquests(self):
         logger.info('Populating authorities and inquests.')
 
-        session = self._db_client.get_session()
+        pipeline = self._create_pipeline('authorities')
+        session, writer = self._open_writer(pipeline)
 
-        # Separate authorities by type and sort by export ID
-        for row in sorted(self._read_workbook('authorities'), key=lambda row: row[-8]):
+        for row in pipeline.read(self._read_authorities_by_export_id()):
             (rserial, rname, _, rtype, rsynopsis, rkeywords, rtags, rquotes, rnotes, rprimary, _, _,
                 roverview, _, _, rjurisdiction, _, _, rprimarydoc, _, rcited, rrelated, _, _, _,
                 rlastname, rgivennames, rdeathdate, rcause, rinqtype, rpresidingofficer, rsex, rage,
@@ -314,17 +546,16 @@ class Migrator:
                     )
 
                 authority_id = self._create_authority(
-                    session, rserial, rname, rsynopsis, rquotes, rnotes, rprimary, roverview, rexport
+                    writer, rname, rsynopsis, rquotes, rnotes, rprimary, roverview, rexport
                 )
 
-                self._authority_serial_to_type[rserial] = self._AUTHORITY_TYPE_AUTHORITY
-                self._authority_serial_to_name[rserial] = utils.format_string(rname)
-                self._authority_serial_to_id[rserial] = authority_id
-                self._authority_serial_to_primary_document[rserial] = rprimarydoc
-                self._authority_serial_to_related[rserial] = (rcited, rrelated)
+                self._authorities.add(rserial, AuthorityRecord(
+                    authority_id, self._AUTHORITY_TYPE_AUTHORITY, utils.format_string(rname),
+                    primary_document=rprimarydoc, cited=rcited, related=rrelated
+                ))
 
-                self._create_authority_keywords(session, authority_id, rserial, rkeywords)
-                self._create_authority_tags(session, authority_id, rtags)
+                self._create_authority_keywords(writer, authority_id, rserial, self._split_keywords(rkeywords))
+                self._create_authority_tags(writer, authority_id, rtags)
 
             elif rtype == self._AUTHORITY_TYPE_INQUEST:
                 authority_fields = {
@@ -340,20 +571,22 @@ class Migrator:
                     )
 
                 inquest_id = self._create_inquest(
-                    session, rserial, rname, rsynopsis, rnotes, rprimary, rjurisdiction,
+                    writer, rname, rsynopsis, rnotes, rprimary, rjurisdiction,
                     rpresidingofficer, rstart, rend, rexport
                 )
 
-                self._authority_serial_to_type[rserial] = self._AUTHORITY_TYPE_INQUEST
-                self._authority_serial_to_name[rserial] = utils.format_string(rname.replace('Inquest-', '', 1))
-                self._authority_serial_to_id[rserial] = inquest_id
+                self._authorities.add(rserial, AuthorityRecord(
+                    inquest_id, self._AUTHORITY_TYPE_INQUEST, utils.format_string(rname.replace('Inquest-', '', 1))
+                ))
 
+                # Keywords are split once for both the cause of death and the inquest keywords.
+                keywords = self._split_keywords(rkeywords)
                 self._create_inquest_deceased(
-                    session, inquest_id, rserial, rkeywords, rlastname, rgivennames, rdeathdate, rcause,
+                    writer, inquest_id, rserial, keywords, rlastname, rgivennames, rdeathdate, rcause,
                     rinqtype, rsex, rage, rdeathmanner
                 )
-                self._create_inquest_keywords(session, inquest_id, rserial, rkeywords)
-                self._create_inquest_tags(session, inquest_id, rtags)
+                self._create_inquest_keywords(writer, inquest_id, rserial, keywords)
+                self._create_inquest_tags(writer, inquest_id, rtags)
 
             else:
                 logger.warning(
@@ -362,12 +595,16 @@ class Migrator:
                 )
                 continue
 
-        session.commit()
+        self._close_writer(pipeline, session, writer)
 
     def _create_authority(
-            self, session, rserial, rname, rsynopsis, rquotes, rnotes, rprimary, roverview, rexport
+            self, writer, rname, rsynopsis, rquotes, rnotes, rprimary, roverview, rexport
         ):
-        authority = models.Authority(
+        # Authority ID is taken from the export ID so that it is known without reading it back from the database.
+        authority_id = rexport
+        writer.add(
+            models.Authority,
+            authorityId=authority_id,
             isPrimary=rprimary,
             name=utils.format_string(rname),
             overview=utils.nullable_to_string(roverview),
@@ -375,20 +612,36 @@ class Migrator:
             quotes=utils.string_to_nullable(rquotes),
             notes=utils.string_to_nullable(rnotes)
         )
-        session.add(authority)
-        session.flush()
-        authority_id = authority.authorityId
-        assert authority_id == rexport,\
-            "Autogenerated authority ID should match export ID for authority with ID: {}".format(rserial)
 
         return authority_id
 
-    def _create_authority_keywords(self, session, authority_id, rserial, rkeywords):
+    def _split_keywords(self, rkeywords):
+        """Split keywords cell into list of (keyword, keyword ID, death cause) tuples."""
         if utils.is_empty_string(rkeywords):
-            return
+            return []
+
+        return [
+            (keyword, self._keyword_serial_to_id(keyword), self._keyword_serial_to_death_cause(keyword))
+            for keyword in rkeywords.split(',')
+        ]
+
+    def _split_tags(self, rtags):
+        """Split tags cell into list of formatted tags without case-insensitive duplicates."""
+        if utils.is_empty_string(rtags):
+            return []
 
-        for keyword in rkeywords.split(','):
-            keyword_id = self._keyword_serial_to_id(keyword)
+        # Note that MySQL is case-insensitive for the UNIQUE constraint.
+        tags = {}
+        for tag in self._TAG_SEPARATOR_PATTERN.split(rtags):
+            if utils.is_empty_string(tag):
+                continue
+            tag = utils.format_as_keyword(tag)
+            tags.setdefault(tag.lower(), tag)
+
+        return list(tags.values())
+
+    def _create_authority_keywords(self, writer, authority_id, rserial, keywords):
+        for keyword, keyword_id, _ in keywords:
             if keyword_id is None:
                 continue
 
@@ -399,42 +652,33 @@ class Migrator:
                 )
                 continue
 
-            session.add(models.AuthorityKeywords(
+            writer.add(
+                models.AuthorityKeywords,
                 authorityId=authority_id,
                 authorityKeywordId=keyword_id,
-            ))
-
-    def _create_authority_tags(self, session, authority_id, rtags):
-        if utils.is_empty_string(rtags):
-            return
-
-        tags = set()
-
-        for tag in re.split(r'[,\n]', rtags):
-            if utils.is_empty_string(tag):
-                continue
-
-            tag = utils.format_as_keyword(tag)
-
-            # Note that MySQL is case-insensitive for the UNIQUE constraint.
-            if tag.lower() in tags:
-                continue
-            tags.add(tag.lower())
+            )
 
-            session.add(models.AuthorityTags(
+    def _create_authority_tags(self, writer, authority_id, rtags):
+        for tag in self._split_tags(rtags):
+            writer.add(
+                models.AuthorityTags,
                 authorityId=authority_id,
                 tag=tag,
-            ))
+            )
 
     def _create_inquest(
-            self, session, rserial, rname, rsynopsis, rnotes, rprimary, rjurisdiction,
+            self, writer, rname, rsynopsis, rnotes, rprimary, rjurisdiction,
             rpresidingofficer, rstart, rend, rexport
         ):
         # Some inquests have their name prefixed with 'Inquest-'; this is redundant.
         if rname.startswith('Inquest-'):
             rname = rname.replace('Inquest-', '', 1)
 
-        inquest = models.Inquest(
+        # Inquest ID is taken from the export ID so that it is known without reading it back from the database.
+        inquest_id = rexport
+        writer.add(
+            models.Inquest,
+            inquestId=inquest_id,
             jurisdictionId=self._jurisdiction_serial_to_id_and_category(rjurisdiction)[0],
             isPrimary=rprimary,
             name=utils.format_string(rname),
@@ -447,16 +691,11 @@ class Migrator:
             sittingDays=None,
             exhibits=None,
         )
-        session.add(inquest)
-        session.flush()
-        inquest_id = inquest.inquestId
-        assert inquest_id == rexport,\
-            "Autogenerated inquest ID should match export ID for inquest with ID: {}".format(rserial)
 
         return inquest_id
 
     def _create_inquest_deceased(
-            self, session, inquest_id, rserial, rkeywords, rlastname, rgivennames, rdeathdate,
+            self, writer, inquest_id, rserial, keywords, rlastname, rgivennames, rdeathdate,
             rcause, rinqtype, rsex, rage, rdeathmanner
         ):
         inquest_types = {
@@ -501,8 +740,7 @@ class Migrator:
 
         # Get cause of death from keywords.
         death_cause_id = None
-        for keyword in rkeywords.split(','):
-            death_cause = self._keyword_serial_to_death_cause(keyword)
+        for _, _, death_cause in keywords:
             if death_cause and death_cause_id:
                 logger.warning('Inquest: %s has multiple "CAUSE" keywords.', rserial)
             elif death_cause:
@@ -519,7 +757,8 @@ class Migrator:
             last_name = utils.format_string(rlastname.title())
             given_names = utils.format_string(rgivennames.title())
 
-        deceased = models.Deceased(
+        writer.add(
+            models.Deceased,
             inquestId=inquest_id,
             inquestTypeId=inquest_type_id,
             deathMannerId=death_manner_id,
@@ -531,18 +770,13 @@ class Migrator:
             age=rage,
             sex=(rsex if rsex != '?' else None)
         )
-        session.add(deceased)
 
-    def _create_inquest_keywords(self, session, inquest_id, rserial, rkeywords):
-        if utils.is_empty_string(rkeywords):
-            return
-
-        for keyword in rkeywords.split(','):
-            if self._keyword_serial_to_death_cause(keyword):
+    def _create_inquest_keywords(self, writer, inquest_id, rserial, keywords):
+        for keyword, keyword_id, death_cause in keywords:
+            if death_cause:
                 # Ignore CAUSE keywords since deathCause is a property of the deceased.
                 continue
 
-            keyword_id = self._keyword_serial_to_id(keyword)
             if keyword_id is None:
                 continue
 
@@ -553,111 +787,121 @@ class Migrator:
                 )
                 continue
 
-            session.add(models.InquestKeywords(
+            writer.add(
+                models.InquestKeywords,
                 inquestId=inquest_id,
                 inquestKeywordId=keyword_id,
-            ))
-
-    def _create_inquest_tags(self, session, inquest_id, rtags):
-        if utils.is_empty_string(rtags):
-            return
-
-        tags = set()
-
-        for tag in re.split(r'[,\n]', rtags):
-            if utils.is_empty_string(tag):
-                continue
-
-            tag = utils.format_as_keyword(tag)
-
-            # Note that MySQL is case-insensitive for the UNIQUE constraint.
-            if tag.lower() in tags:
-                continue
-            tags.add(tag.lower())
+            )
 
-            session.add(models.InquestTags(
+    def _create_inquest_tags(self, writer, inquest_id, rtags):
+        for tag in self._split_tags(rtags):
+            writer.add(
+                models.InquestTags,
                 inquestId=inquest_id,
                 tag=tag,
-            ))
+            )
 
+    @_phase('relationships')
     def populate_authority_relationships(self):
         logger.info('Populating authority relationships.')
 
-        session = self._db_client.get_session()
+        pipeline = self._create_pipeline('relationships')
+        session, writer = self._open_writer(pipeline)
 
-        for (serial, (cited, related)) in self._authority_serial_to_related.items():
-            # Map authority to its cited authorities and related authorities.
-            if cited is not None:
-                for cited_serial in cited.split('\n'):
-                    if utils.is_empty_string(cited_serial):
-                        continue
+        # Edges are collected into sets first, since an authority may list the same reference twice and each edge is
+        # the primary key of its table.
+        citations = set()
+        related_authorities = set()
+        related_inquests = set()
 
-                    # Ignore references to authorities which do not exist.
-                    if cited_serial not in self._authority_serial_to_id:
-                        logger.warning(
-                            'Authority: %s cites invalid authority: %s',
-                            serial, cited_serial
-                        )
-                        continue
+        for serial, record in self._authorities.items():
+            # Map authority to its cited authorities and related authorities.
+            for cited_serial in record.cited_serials:
+                # Ignore references to authorities which do not exist.
+                if cited_serial not in self._authorities:
+                    logger.warning(
+                        'Authority: %s cites invalid authority: %s',
+                        serial, cited_serial
+                    )
+                    continue
+                cited_record = self._authorities[cited_serial]
 
-                    # Ignore references to inquests.
-                    if self._authority_serial_to_type[cited_serial] == self._AUTHORITY_TYPE_INQUEST:
-                        logger.warning(
-                            'Authority: %s cites inquest: %s',
-                            serial, cited_serial
-                        )
-                        continue
+                # Ignore references to inquests.
+                if cited_record.type == self._AUTHORITY_TYPE_INQUEST:
+                    logger.warning(
+                        'Authority: %s cites inquest: %s',
+                        serial, cited_serial
+                    )
+                    continue
 
-                    session.add(models.AuthorityCitations(
-                        authorityId=self._authority_serial_to_id[serial],
-                        citedAuthorityId=self._authority_serial_to_id[cited_serial],
-                    ))
+                citations.add((record.id, cited_record.id))
 
-            if related is not None:
-                for related_serial in related.split('\n'):
-                    if utils.is_empty_string(related_serial):
-                        continue
+            for related_serial in record.related_serials:
+                # Ignore references to authorities which do not exist.
+                if related_serial not in self._authorities:
+                    logger.warning(
+                        'Authority: %s is related to invalid authority: %s',
+                        serial, related_serial
+                    )
+                    continue
+                related_record = self._authorities[related_serial]
 
-                    # Ignore references to authorities which do not exist.
-                    if related_serial not in self._authority_serial_to_id:
-                        logger.warning(
-                            'Authority: %s is related to invalid authority: %s',
-                            serial, related_serial
-                        )
-                        continue
+                if related_record.type == self._AUTHORITY_TYPE_INQUEST:
+                    related_inquests.add((record.id, related_record.id))
+                else:
+                    related_authorities.add((record.id, related_record.id))
 
-                    if self._authority_serial_to_type[related_serial] == self._AUTHORITY_TYPE_INQUEST:
-                        session.add(models.AuthorityInquests(
-                            authorityId=self._authority_serial_to_id[serial],
-                            inquestId=self._authority_serial_to_id[related_serial],
-                        ))
-                    else:
-                        session.add(models.AuthorityRelated(
-                            authorityId=self._authority_serial_to_id[serial],
-                            relatedAuthorityId=self._authority_serial_to_id[related_serial],
-                        ))
+        for authority_id, cited_authority_id in citations:
+            writer.add(
+                models.AuthorityCitations,
+                authorityId=authority_id,
+                citedAuthorityId=cited_authority_id,
+            )
+        for authority_id, related_authority_id in related_authorities:
+            writer.add(
+                models.AuthorityRelated,
+                authorityId=authority_id,
+                relatedAuthorityId=related_authority_id,
+            )
+        for authority_id, inquest_id in related_inquests:
+            writer.add(
+                models.AuthorityInquests,
+                authorityId=authority_id,
+                inquestId=inquest_id,
+            )
 
-        session.commit()
+        self._close_writer(pipeline, session, writer)
 
+    @_phase('documents')
     def populate_documents(self):
         logger.info('Populating authority and inquest documents.')
 
-        session = self._db_client.get_session()
+        # Document directories are listed once up front rather than for each document and authority pair.
+        if self._row_checker is None or self._document_files_directory is not None:
+            self._document_files = DocumentFileIndex(self._document_files_directory)
+            logger.info('Indexed files of %d documents.', len(self._document_files))
+
+        pipeline = self._create_pipeline('documents')
+        session, writer = self._open_writer(pipeline)
 
         document_sources = set()
 
-        for row in self._read_workbook('docs'):
+        # Document IDs are assigned here rather than by the database so that links can be batched with documents.
+        authority_document_id = 0
+        inquest_document_id = 0
+
+        for row in pipeline.read(self._read_workbook('docs')):
             rauthorities, rserial, rshortname, rcitation, rdate, rlink, rlinktype, rsource = row
 
             if rlinktype.lower() != 'no publish':
                 # Create document source type (i.e., the location where the document is stored) if it does not exist.
                 document_source_id = utils.format_as_id(rlinktype)
                 if document_source_id not in document_sources:
-                    session.add(models.DocumentSource(
+                    writer.add(
+                        models.DocumentSource,
                         documentSourceId=document_source_id,
                         name=utils.format_string(rlinktype),
-                    ))
-                    session.flush()
+                    )
                     document_sources.add(document_source_id)
 
             # Ensure document references at least one authority.
@@ -670,12 +914,14 @@ class Migrator:
                     continue
 
                 # Ignore references to authorities which do not exist.
-                if authority_serial not in self._authority_serial_to_id:
+                if authority_serial not in self._authorities:
                     logger.warning(
                         'Document: %s references invalid authority: %s',
                         rserial, authority_serial
                     )
                     continue
+                record = self._authorities[authority_serial]
+                created, year = utils.parse_date(rdate)
 
                 # Upload document to S3 if respective file exists locally.
                 link = None
@@ -685,7 +931,7 @@ class Migrator:
                             'Document: %s has source Inquests.ca and non-null link: %s',
                             rserial, rlink
                         )
-                    s3_link = self._upload_document_if_exists(rshortname, rdate, rsource, rserial, authority_serial)
+                    s3_link = self._upload_document_if_exists(rshortname, year, rsource, rserial, authority_serial)
                     if s3_link is not None:
                         link = s3_link
                 elif rlinktype.lower() == 'no publish':
@@ -702,24 +948,26 @@ class Migrator:
                     else:
                         logger.warning('Document: %s has null link.', rserial)
 
-                if self._authority_serial_to_type[authority_serial] == self._AUTHORITY_TYPE_AUTHORITY:
-                    authority_document = models.AuthorityDocument(
-                        authorityId=self._authority_serial_to_id[authority_serial],
+                if record.type == self._AUTHORITY_TYPE_AUTHORITY:
+                    authority_document_id += 1
+                    writer.add(
+                        models.AuthorityDocument,
+                        authorityDocumentId=authority_document_id,
+                        authorityId=record.id,
                         authorityDocumentTypeId=None,
                         sourceId=self._source_serial_to_id(rsource),
-                        isPrimary=rcitation == self._authority_serial_to_primary_document[authority_serial],
+                        isPrimary=rcitation == record.primary_document,
                         name=utils.format_string(rshortname),
                         citation=utils.format_string(rcitation),
-                        created=utils.format_date(rdate),
+                        created=created,
                     )
-                    session.add(authority_document)
-                    session.flush()
                     if link is not None:
-                        session.add(models.AuthorityDocumentLinks(
-                            authorityDocumentId=authority_document.authorityDocumentId,
+                        writer.add(
+                            models.AuthorityDocumentLinks,
+                            authorityDocumentId=authority_document_id,
                             documentSourceId=document_source_id,
                             link=link,
-                        ))
+                        )
                 else:
                     if rshortname.startswith('Inquest-'):
                         # Some inquest documents begin with 'Inquest-'; this is redundant.
@@ -727,101 +975,53 @@ class Migrator:
                     else:
                         document_name = rshortname
 
-                    inquest_document = models.InquestDocument(
-                        inquestId=self._authority_serial_to_id[authority_serial],
+                    inquest_document_id += 1
+                    writer.add(
+                        models.InquestDocument,
+                        inquestDocumentId=inquest_document_id,
+                        inquestId=record.id,
                         inquestDocumentTypeId=None,
                         name=utils.format_string(document_name),
-                        created=utils.format_date(rdate),
+                        created=created,
                     )
-                    session.add(inquest_document)
-                    session.flush()
                     if link is not None:
-                        session.add(models.InquestDocumentLinks(
-                            inquestDocumentId=inquest_document.inquestDocumentId,
+                        writer.add(
+                            models.InquestDocumentLinks,
+                            inquestDocumentId=inquest_document_id,
                             documentSourceId=document_source_id,
                             link=link,
-                        ))
+                        )
 
-        session.commit()
+        self._close_writer(pipeline, session, writer)
 
-    def validate(self):
-        logger.info('Running SQL validation scripts.')
+    @_phase('delta')
+    def apply_delta(self):
+        logger.info('Applying changes to existing data.')
 
-        session = self._db_client.get_session()
+        session = self._get_db_client().get_session()
+        self._delta_writer.apply(session)
+        session.commit()
 
-        # Invert mapping of authority IDs to map new IDs to input IDs.
-        authority_id_to_serial = {
-            new_id: serial for serial, new_id in self._authority_serial_to_id.items()
-            if self._authority_serial_to_type[serial] == self._AUTHORITY_TYPE_AUTHORITY
-        }
-        inquest_id_to_serial = {
-            new_id: serial for serial, new_id in self._authority_serial_to_id.items()
-            if self._authority_serial_to_type[serial] == self._AUTHORITY_TYPE_INQUEST
-        }
+    @_phase('validate')
+    def validate(self, db_client=None):
+        """
+        Run checks against the local database, or against the database of given client. Returns number of problems.
+        """
+        logger.info('Running SQL validation scripts.')
 
-        # Ensure each authority has exactly one primary document.
-        query = sqlalchemy.text("""
-            SELECT authority.authorityId, authorityDocument.isPrimary, COUNT(authority.authorityId) AS cnt
-            FROM authority
-            LEFT JOIN authorityDocument ON authority.authorityId = authorityDocument.authorityId AND authorityDocument.isPrimary = 1
-            GROUP BY authority.authorityId, authorityDocument.isPrimary
-            HAVING authorityDocument.isPrimary IS NULL OR cnt > 1;
-        """)
-        rows = session.execute(query).fetchall()
-
-        for row in rows:
-            authority_id, has_primary, count = row
-            if not has_primary:
-                count = 0
-            logger.warning(
-                'Authority: %s has %d primary documents.',
-                authority_id_to_serial[authority_id], count
-            )
+        session = (db_client or self._get_db_client()).get_session()
 
-        # Ensure each inquest has at least one document.
-        query = sqlalchemy.text("""
-            SELECT inquest.inquestId
-            FROM inquest
-            LEFT JOIN inquestDocument ON inquest.inquestId = inquestDocument.inquestId
-            WHERE inquestDocument.inquestId IS NULL;
-        """)
-        rows = session.execute(query).fetchall()
-
-        for row in rows:
-            inquest_id = row[0]
-            logger.warning(
-                'Inquest: %s does not have any documents.',
-                inquest_id_to_serial[inquest_id]
-            )
+        violation_count = self._validator.validate(session, self._get_labels())
+        logger.info('Validation found %d problems.', violation_count)
 
-        # Ensure each authority has at least one keyword.
-        query = sqlalchemy.text("""
-            SELECT authority.authorityId
-            FROM authority
-            LEFT JOIN authorityKeywords ON authorityKeywords.authorityId = authority.authorityId
-            WHERE authorityKeywords.authorityId IS NULL;
-        """)
-        rows = session.execute(query).fetchall()
-
-        for row in rows:
-            authority_id = row[0]
-            logger.warning(
-                'Authority: %s does not have any keywords.',
-                authority_id_to_serial[authority_id]
-            )
+        return violation_count
 
-        # Ensure each inquest has at least one keyword.
-        query = sqlalchemy.text("""
-            SELECT inquest.inquestId
-            FROM inquest
-            LEFT JOIN inquestKeywords ON inquestKeywords.inquestId = inquest.inquestId
-            WHERE inquestKeywords.inquestId IS NULL;
-        """)
-        rows = session.execute(query).fetchall()
-
-        for row in rows:
-            inquest_id = row[0]
-            logger.warning(
-                'Inquest: %s does not have any keywords.',
-                inquest_id_to_serial[inquest_id]
-            )
+    def _get_labels(self):
+        """Returns labels identifying authorities and inquests in warnings by their input serials."""
+        labels = {'authority': {}, 'inquest': {}}
+        for serial, record in self._authorities.items():
+            if record.type == self._AUTHORITY_TYPE_AUTHORITY:
+                labels['authority'][record.id] = serial
+            else:
+                labels['inquest'][record.id] = serial
+        return labels
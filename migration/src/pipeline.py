@@ -0,0 +1,183 @@
+import collections
+import queue
+import threading
+import time
+
+from logger import logger
+
+# Number of rows passed between stages at once.
+_CHUNK_SIZE = 100
+
+# Sentinel marking the end of a queue.
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs a populate phase as three stages: rows are read on a background thread, transformed on the calling thread
+    and written on another background thread. Stages exchange chunks of rows through bounded queues, so a slow stage
+    blocks the stage feeding it rather than letting rows pile up in memory.
+    """
+
+    def __init__(self, name, queue_size, metrics=None):
+        self._name = name
+        self._queue_size = queue_size
+        self._metrics = metrics
+        self._start_time = time.monotonic()
+
+        # Seconds the reader spent working, and seconds the transformer spent blocked on the reader.
+        self._read_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._read_count = 0
+        self._writers = []
+
+    def read(self, rows):
+        """Yields given rows, which are read ahead on a background thread."""
+        chunks = queue.Queue(maxsize=self._queue_size)
+        stopped = threading.Event()
+
+        def read_rows():
+            try:
+                chunk = []
+                start_time = time.monotonic()
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= _CHUNK_SIZE:
+                        self._read_seconds += time.monotonic() - start_time
+                        self._put(chunks, chunk, stopped)
+                        chunk = []
+                        start_time = time.monotonic()
+                self._read_seconds += time.monotonic() - start_time
+                self._put(chunks, chunk, stopped)
+                self._put(chunks, _DONE, stopped)
+            except BaseException as error:
+                self._put(chunks, error, stopped)
+
+        thread = threading.Thread(target=read_rows, name='{}-reader'.format(self._name), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                start_time = time.monotonic()
+                chunk = chunks.get()
+                self._wait_seconds += time.monotonic() - start_time
+
+                if chunk is _DONE:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+
+                self._read_count += len(chunk)
+                yield from chunk
+        finally:
+            # Release the reader if the rows were not consumed to the end.
+            stopped.set()
+            thread.join()
+
+    def write(self, writer):
+        """Returns writer which passes added rows to given writer on a background thread."""
+        pipelined_writer = _PipelinedWriter('{}-writer'.format(self._name), writer, self._queue_size)
+        self._writers.append(pipelined_writer)
+        return pipelined_writer
+
+    def log(self):
+        elapsed = time.monotonic() - self._start_time
+        wait_seconds = self._wait_seconds + sum(writer.wait_seconds for writer in self._writers)
+        stage_seconds = {
+            'reader': self._read_seconds,
+            'transformer': max(elapsed - wait_seconds, 0.0),
+            'writer': sum(writer.write_seconds for writer in self._writers),
+        }
+        table_row_counts = collections.Counter()
+        for writer in self._writers:
+            table_row_counts.update(writer.table_row_counts)
+
+        logger.info(
+            'Pipeline: %s read %d and wrote %d rows in %.2fs; reader busy %.2fs, transformer busy %.2fs, '
+            'writer busy %.2fs; limited by %s.',
+            self._name, self._read_count, sum(table_row_counts.values()), elapsed, stage_seconds['reader'],
+            stage_seconds['transformer'], stage_seconds['writer'], max(stage_seconds, key=stage_seconds.get)
+        )
+
+        if self._metrics is not None:
+            self._metrics.record_stages(stage_seconds, table_row_counts)
+
+    def _put(self, chunks, chunk, stopped):
+        # Time out periodically so that the reader notices when the rows are no longer consumed.
+        while not stopped.is_set():
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class _PipelinedWriter:
+    """Passes added rows to given writer on a background thread, through a bounded queue."""
+
+    def __init__(self, thread_name, writer, queue_size):
+        self._writer = writer
+        self._chunk = []
+        self._chunks = queue.Queue(maxsize=queue_size)
+        self._error = None
+
+        # Seconds the writer spent working, and seconds the transformer spent blocked on the writer.
+        self.write_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.table_row_counts = collections.Counter()
+
+        self._thread = threading.Thread(target=self._write_rows, name=thread_name, daemon=True)
+        self._thread.start()
+
+    def add(self, model, **values):
+        self._chunk.append((model, values))
+        if len(self._chunk) >= _CHUNK_SIZE:
+            self._put(self._chunk)
+            self._chunk = []
+
+    def flush(self):
+        """Wait for every added row to be written and flush the underlying writer."""
+        self._put(self._chunk)
+        self._chunk = []
+        self._put(_DONE)
+
+        # Waiting for the rows still queued to be written also blocks the transformer on the writer.
+        start_time = time.monotonic()
+        self._thread.join()
+        self.wait_seconds += time.monotonic() - start_time
+
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, chunk):
+        start_time = time.monotonic()
+        self._chunks.put(chunk)
+        self.wait_seconds += time.monotonic() - start_time
+
+    def _write_rows(self):
+        while True:
+            chunk = self._chunks.get()
+
+            if chunk is _DONE:
+                # The underlying writer is only flushed if every row was added; either way this is the last chunk.
+                if self._error is None:
+                    self._run_timed(self._writer.flush)
+                return
+
+            # After an error, keep draining the queue so that the transformer is never blocked.
+            if self._error is None:
+                self._run_timed(self._add_rows, chunk)
+
+    def _add_rows(self, chunk):
+        for model, values in chunk:
+            self._writer.add(model, **values)
+            self.table_row_counts[model.__tablename__] += 1
+
+    def _run_timed(self, function, *args):
+        start_time = time.monotonic()
+        try:
+            function(*args)
+        except BaseException as error:
+            self._error = error
+        finally:
+            self.write_seconds += time.monotonic() - start_time
@@ -0,0 +1,98 @@
+import cProfile
+import collections
+import contextlib
+import datetime
+import os
+import sys
+import threading
+
+from logger import logger
+
+
+class Profiler:
+    """
+    Profiles each phase of a run into ./logs, either deterministically with cProfile or by periodically sampling the
+    stacks of every thread into a collapsed-stack file for flamegraphs.
+    """
+
+    MODE_DETERMINISTIC = 'cprofile'
+    MODE_SAMPLING = 'sample'
+
+    _DIRECTORY = './logs'
+    _SAMPLE_INTERVAL_SECONDS = 0.005
+
+    def __init__(self, mode):
+        self._mode = mode
+        self._file_prefix = os.path.join(self._DIRECTORY, datetime.datetime.now().strftime('%Y-%m-%d'))
+
+        self._current_phase = None
+        self._stack_counts = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start sampling, if sampling; phases are profiled deterministically as they run."""
+        if self._mode == self.MODE_SAMPLING:
+            self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Attribute the enclosed block to given phase."""
+        previous_phase = self._current_phase
+        self._current_phase = name
+
+        if self._mode != self.MODE_DETERMINISTIC:
+            try:
+                yield
+            finally:
+                self._current_phase = previous_phase
+            return
+
+        # cProfile only follows the thread which enabled it, i.e. the transformer stage of pipelined phases.
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._current_phase = previous_phase
+
+            profile_path = '{}-profile-{}.prof'.format(self._file_prefix, name)
+            profile.dump_stats(profile_path)
+            logger.info('Profile of phase: %s written to: %s', name, profile_path)
+
+    def close(self):
+        """Stop sampling and write the collapsed stacks of every sampled phase."""
+        if self._sampler is None:
+            return
+
+        self._stopped.set()
+        self._sampler.join()
+        self._sampler = None
+
+        stacks_path = '{}-profile.collapsed'.format(self._file_prefix)
+        with open(stacks_path, 'w', encoding='utf-8') as stacks_file:
+            for stack, count in sorted(self._stack_counts.items()):
+                stacks_file.write('{} {}\n'.format(stack, count))
+        logger.info('Sampled stacks written to: %s', stacks_path)
+
+    def _sample(self):
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self._SAMPLE_INTERVAL_SECONDS):
+            phase = self._current_phase or 'other'
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            # The only way to read the stacks of other threads.
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id == sampler_id:
+                    continue
+
+                frames = []
+                while frame is not None:
+                    frames.append('{} ({})'.format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)))
+                    frame = frame.f_back
+
+                # Stacks are rooted at the phase and thread so that flamegraphs group samples by both.
+                frames.extend([thread_names.get(thread_id, str(thread_id)), phase])
+                self._stack_counts[';'.join(reversed(frames))] += 1
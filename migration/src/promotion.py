@@ -0,0 +1,350 @@
+import contextlib
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.engine.url import URL
+
+from db import DatabaseClient
+from logger import logger
+
+
+class IncrementalPromoter:
+    """
+    Promotes the local database to production by comparing per-row checksums of every table and applying only the
+    rows which differ, in batched transactions.
+    """
+
+    def __init__(self, local_db_url, production_db_url, batch_size):
+        self._local_engine = sqlalchemy.create_engine(local_db_url)
+        self._production_engine = sqlalchemy.create_engine(production_db_url)
+        self._batch_size = batch_size
+
+    def promote(self, dry_run):
+        """Apply differences to production; if dry_run is set, only report them."""
+        metadata = sqlalchemy.MetaData()
+        metadata.reflect(bind=self._local_engine)
+
+        changes = []
+        for table in metadata.sorted_tables:
+            if not table.primary_key.columns:
+                logger.warning('Table: %s has no primary key and will not be promoted.', table.name)
+                continue
+
+            upserted_keys, deleted_keys = self._diff(table)
+            logger.info(
+                'Table: %s has %d new or changed and %d deleted rows.',
+                table.name, len(upserted_keys), len(deleted_keys)
+            )
+            changes.append((table, upserted_keys, deleted_keys))
+
+        if dry_run:
+            return
+
+        with self._production_engine.connect() as production_connection:
+            # Batches are committed separately, so constraints may only hold once every batch has been applied.
+            production_connection.execute(sqlalchemy.text('SET FOREIGN_KEY_CHECKS = 0'))
+            try:
+                for table, upserted_keys, deleted_keys in changes:
+                    self._apply(production_connection, table, upserted_keys, deleted_keys)
+            finally:
+                production_connection.execute(sqlalchemy.text('SET FOREIGN_KEY_CHECKS = 1'))
+
+    def _diff(self, table):
+        """Return tuple of keys of rows to insert or update and keys of rows to delete in production."""
+        local_checksums = self._get_checksums(self._local_engine, table)
+        production_checksums = self._get_checksums(self._production_engine, table)
+
+        upserted_keys = [
+            key for key, checksum in local_checksums.items()
+            if production_checksums.get(key) != checksum
+        ]
+        deleted_keys = [key for key in production_checksums if key not in local_checksums]
+
+        return upserted_keys, deleted_keys
+
+    def _get_checksums(self, engine, table):
+        """Return mapping from primary key to checksum of each row in given table."""
+        # CONCAT_WS skips NULLs, so NULL flags are appended to tell NULLs apart from empty strings.
+        checksum = sqlalchemy.func.md5(sqlalchemy.func.concat_ws(
+            '|',
+            *table.columns,
+            sqlalchemy.func.concat(*[sqlalchemy.func.isnull(column) for column in table.columns])
+        ))
+        query = sqlalchemy.select(list(table.primary_key.columns) + [checksum])
+
+        with engine.connect() as connection:
+            return {tuple(row[:-1]): row[-1] for row in connection.execute(query)}
+
+    def _apply(self, production_connection, table, upserted_keys, deleted_keys):
+        primary_key = sqlalchemy.tuple_(*table.primary_key.columns)
+
+        for start in range(0, len(deleted_keys), self._batch_size):
+            with production_connection.begin():
+                production_connection.execute(
+                    table.delete().where(primary_key.in_(deleted_keys[start:start + self._batch_size]))
+                )
+
+        with self._local_engine.connect() as local_connection:
+            for start in range(0, len(upserted_keys), self._batch_size):
+                rows = [
+                    dict(row) for row in local_connection.execute(
+                        table.select().where(primary_key.in_(upserted_keys[start:start + self._batch_size]))
+                    )
+                ]
+
+                # Tables consisting only of a primary key still need an update clause, which is then a no-op.
+                statement = insert(table)
+                updated_columns = [column for column in table.columns if not column.primary_key] or table.columns
+                statement = statement.on_duplicate_key_update({
+                    column.name: statement.inserted[column.name] for column in updated_columns
+                })
+
+                with production_connection.begin():
+                    production_connection.execute(statement, rows)
+
+
+class ParallelDumpPromoter:
+    """
+    Promotes the local database to production with one compressed mysqldump | mysql stream per table. Tables are
+    streamed concurrently in groups, where each group only references tables of earlier groups.
+    """
+
+    _CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, local_db_url, local_database, production_mysql_args, max_workers):
+        self._local_engine = sqlalchemy.create_engine(local_db_url)
+        self._local_database = local_database
+        self._production_mysql_args = production_mysql_args
+        self._max_workers = max_workers
+
+    def promote(self):
+        metadata = sqlalchemy.MetaData()
+        metadata.reflect(bind=self._local_engine)
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for group in self._get_table_groups(metadata):
+                # Wait for every table of the group before starting the tables which reference them.
+                for future in [executor.submit(self._promote_table, table) for table in group]:
+                    future.result()
+
+    def _get_table_groups(self, metadata):
+        """Return lists of tables such that tables only reference tables in earlier lists (or themselves)."""
+        levels = {}
+        for table in metadata.sorted_tables:
+            referenced_levels = [
+                levels[foreign_key.column.table.name] for foreign_key in table.foreign_keys
+                if foreign_key.column.table is not table
+            ]
+            levels[table.name] = max(referenced_levels, default=-1) + 1
+
+        groups = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+        for table in metadata.sorted_tables:
+            groups[levels[table.name]].append(table)
+        return groups
+
+    def _promote_table(self, table):
+        with self._local_engine.connect() as connection:
+            row_count = connection.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(table)).scalar()
+
+        start_time = time.monotonic()
+
+        mysqldump_process = subprocess.Popen(
+            [
+                'mysqldump', self._local_database, table.name, '-u', 'root',
+                '--compress', '--extended-insert', '--single-transaction',
+            ],
+            stdout=subprocess.PIPE,
+        )
+        mysql_process = None
+        try:
+            mysql_process = subprocess.Popen(self._production_mysql_args + ['--compress'], stdin=subprocess.PIPE)
+
+            # Stream the dump through this process to measure the amount of data transferred.
+            byte_count = 0
+            try:
+                for chunk in iter(lambda: mysqldump_process.stdout.read(self._CHUNK_SIZE), b''):
+                    mysql_process.stdin.write(chunk)
+                    byte_count += len(chunk)
+                mysql_process.stdin.close()
+            except BrokenPipeError:
+                # mysql exited early; its exit status is reported below.
+                pass
+
+            if mysql_process.wait() != 0:
+                raise subprocess.CalledProcessError(mysql_process.returncode, mysql_process.args)
+            if mysqldump_process.wait() != 0:
+                raise subprocess.CalledProcessError(mysqldump_process.returncode, mysqldump_process.args)
+        finally:
+            # Neither process may outlive a failed stream; mysqldump would otherwise block on its full pipe.
+            for process in [mysqldump_process, mysql_process]:
+                if process is None:
+                    continue
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+            mysqldump_process.stdout.close()
+            if mysql_process is not None:
+                with contextlib.suppress(BrokenPipeError):
+                    mysql_process.stdin.close()
+
+        elapsed = max(time.monotonic() - start_time, 1e-6)
+        megabytes = byte_count / (1024 * 1024)
+        logger.info(
+            'Table: %s promoted %d rows (%.1f MB) in %.1fs: %.0f rows/s, %.2f MB/s.',
+            table.name, row_count, megabytes, elapsed, row_count / elapsed, megabytes / elapsed
+        )
+
+
+class ShadowPromoter:
+    """
+    Promotes the local database to production by loading it into a shadow database and swapping every table into
+    production with a single, atomic RENAME TABLE. The replaced tables are kept in a database for rollback.
+    """
+
+    def __init__(self, production_db_url):
+        self._production_db_url = production_db_url
+        self._production_engine = sqlalchemy.create_engine(production_db_url)
+
+        self._live_database = production_db_url.database
+        self._shadow_database = '{}_next'.format(self._live_database)
+        self._previous_database = '{}_prev'.format(self._live_database)
+
+    def promote(self, local_db_url, local_database, max_workers, validate, confirm_problems):
+        """
+        Load local database into the shadow database, validate it with given callable and swap it in. If validation
+        finds problems, the swap only proceeds if given callable confirms it for the number of problems.
+        """
+        shadow_db_url = _with_database(self._production_db_url, self._shadow_database)
+
+        with self._production_engine.connect() as connection:
+            self._recreate_database(connection, self._shadow_database)
+
+        logger.info('Loading data into shadow database: %s', self._shadow_database)
+        ParallelDumpPromoter(local_db_url, local_database, get_mysql_args(shadow_db_url), max_workers).promote()
+
+        self._check_row_counts(local_db_url, shadow_db_url)
+        self._check_table_names()
+        problem_count = validate(DatabaseClient(shadow_db_url))
+        if problem_count and not confirm_problems(problem_count):
+            raise RuntimeError('Shadow database: {} has {} problems and was not swapped into production.'.format(
+                self._shadow_database, problem_count
+            ))
+
+        with self._production_engine.connect() as connection:
+            self._recreate_database(connection, self._previous_database)
+            self._rename_tables(connection, [
+                (self._live_database, self._previous_database),
+                (self._shadow_database, self._live_database),
+            ])
+            connection.execute(sqlalchemy.text('DROP DATABASE `{}`'.format(self._shadow_database)))
+
+        logger.info('Swapped shadow database into production; previous tables kept in: %s', self._previous_database)
+
+    def rollback(self):
+        """Swap the tables replaced by the last promotion back into production."""
+        with self._production_engine.connect() as connection:
+            if not self._get_table_names(connection, self._previous_database):
+                raise RuntimeError('No previous tables to roll back to in: {}'.format(self._previous_database))
+
+            # The shadow database temporarily holds the current tables so that both sets can swap in one statement.
+            self._recreate_database(connection, self._shadow_database)
+            self._rename_tables(connection, [
+                (self._live_database, self._shadow_database),
+                (self._previous_database, self._live_database),
+                (self._shadow_database, self._previous_database),
+            ])
+            connection.execute(sqlalchemy.text('DROP DATABASE `{}`'.format(self._shadow_database)))
+
+        logger.info('Rolled back production; replaced tables kept in: %s', self._previous_database)
+
+    def _recreate_database(self, connection, database):
+        connection.execute(sqlalchemy.text('DROP DATABASE IF EXISTS `{}`'.format(database)))
+        connection.execute(sqlalchemy.text('CREATE DATABASE `{}` DEFAULT CHARACTER SET utf8'.format(database)))
+
+    def _rename_tables(self, connection, moves):
+        """Move all tables of each (source, target) database pair, in order, within one RENAME TABLE statement."""
+        # Track which tables each database holds after each move, since a later move in the same statement may
+        # move tables which an earlier move put there.
+        table_names = {}
+        renames = []
+        for source, target in moves:
+            for database in (source, target):
+                if database not in table_names:
+                    table_names[database] = self._get_table_names(connection, database)
+
+            renames.extend(
+                '`{0}`.`{2}` TO `{1}`.`{2}`'.format(source, target, table_name)
+                for table_name in table_names[source]
+            )
+            table_names[target] = table_names[target] + table_names[source]
+            table_names[source] = []
+
+        connection.execute(sqlalchemy.text('RENAME TABLE {}'.format(', '.join(renames))))
+
+    def _get_table_names(self, connection, database):
+        rows = connection.execute(
+            sqlalchemy.text("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = :database AND table_type = 'BASE TABLE'
+            """),
+            {'database': database}
+        )
+        return [row[0] for row in rows]
+
+    def _check_table_names(self):
+        """Ensure every production table has a replacement, since every table of production is swapped out."""
+        with self._production_engine.connect() as connection:
+            missing_table_names = sorted(
+                set(self._get_table_names(connection, self._live_database)) -
+                set(self._get_table_names(connection, self._shadow_database))
+            )
+        if missing_table_names:
+            raise RuntimeError('Tables: {} of production are missing from shadow database: {}.'.format(
+                ', '.join(missing_table_names), self._shadow_database
+            ))
+
+    def _check_row_counts(self, local_db_url, shadow_db_url):
+        """Ensure every table was copied completely before it is swapped into production."""
+        local_engine = sqlalchemy.create_engine(local_db_url)
+        shadow_engine = sqlalchemy.create_engine(shadow_db_url)
+
+        metadata = sqlalchemy.MetaData()
+        metadata.reflect(bind=local_engine)
+
+        with local_engine.connect() as local_connection, shadow_engine.connect() as shadow_connection:
+            for table in metadata.sorted_tables:
+                count_query = sqlalchemy.select([sqlalchemy.func.count()]).select_from(table)
+                local_count = local_connection.execute(count_query).scalar()
+                shadow_count = shadow_connection.execute(count_query).scalar()
+
+                if local_count != shadow_count:
+                    raise RuntimeError('Table: {} has {} rows locally but {} rows in shadow database.'.format(
+                        table.name, local_count, shadow_count
+                    ))
+
+
+def get_mysql_args(db_url):
+    """Return arguments for the MySQL CLI to connect to given database."""
+    # TODO: avoid passing MySQL password through CLI.
+    return [
+        'mysql',
+        '--user={}'.format(db_url.username),
+        '--password={}'.format(db_url.password),
+        '--host={}'.format(db_url.host),
+        '--port={}'.format(db_url.port),
+        '--database={}'.format(db_url.database),
+    ]
+
+
+def _with_database(db_url, database):
+    return URL(
+        db_url.drivername,
+        username=db_url.username,
+        password=db_url.password,
+        host=db_url.host,
+        port=db_url.port,
+        database=database,
+    )
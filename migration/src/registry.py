@@ -0,0 +1,44 @@
+import sys
+
+import utils
+
+
+class AuthorityRecord:
+    """Attributes of a migrated authority or inquest."""
+
+    __slots__ = ('id', 'type', 'name', 'primary_document', 'cited_serials', 'related_serials')
+
+    def __init__(self, authority_id, authority_type, name, primary_document=None, cited=None, related=None):
+        self.id = authority_id
+        self.type = authority_type
+        self.name = name
+        self.primary_document = primary_document
+
+        # References are split once when registered rather than kept as raw multi-line strings.
+        self.cited_serials = _split_serials(cited)
+        self.related_serials = _split_serials(related)
+
+
+class AuthorityRegistry:
+    """Mapping from serial to record of every migrated authority and inquest."""
+
+    def __init__(self):
+        self._records = {}
+
+    def __contains__(self, serial):
+        return serial in self._records
+
+    def __getitem__(self, serial):
+        return self._records[serial]
+
+    def add(self, serial, record):
+        self._records[sys.intern(serial)] = record
+
+    def items(self):
+        return self._records.items()
+
+
+def _split_serials(serials):
+    if serials is None:
+        return ()
+    return tuple(sys.intern(serial) for serial in serials.split('\n') if not utils.is_empty_string(serial))
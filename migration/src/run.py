@@ -2,7 +2,9 @@
 Parses data from given Excel sheets and inserts data into to the local MySQL
 database and optionally the production MySQL database.
 
-This script requires that the MySQL CLI tools are installed locally.
+This script requires that the MySQL CLI tools are installed locally. Loading with
+--load-mode=infile additionally requires local_infile to be enabled on the local
+MySQL server.
 
 NOTE: this script should only be run locally since the MySQL password is passed
 in the CLI.
@@ -11,12 +13,22 @@ in the CLI.
 import argparse
 import re
 import subprocess
+import sys
 
-from logger import logger
+from sqlalchemy.engine.url import URL
+
+from logger import init_logger, logger
 from migration import Migrator
+from profiling import Profiler
+from promotion import IncrementalPromoter, ParallelDumpPromoter, ShadowPromoter, get_mysql_args
 
 LOCAL_DATABASE_URL = "mysql+pymysql://root@127.0.0.1:3306/"
 
+PROMOTE_MODE_DUMP = 'dump'
+PROMOTE_MODE_INCREMENTAL = 'incremental'
+PROMOTE_MODE_PARALLEL = 'parallel'
+PROMOTE_MODE_SHADOW = 'shadow'
+
 
 def _init_db():
     logger.info('Initializing DB schema.')
@@ -31,10 +43,78 @@ def _parse_args():
     parser.add_argument('--documents', help='Directory containing documents')
     parser.add_argument('--db', help='Local database')
     parser.add_argument('--upload', action='store_true', help='Whether to upload documents to AWS S3')
+    parser.add_argument('--upload-workers', type=int, default=8, help='Number of documents uploaded concurrently')
+    parser.add_argument(
+        '--verify-manifest',
+        action='store_true',
+        help='Reconcile the local upload manifest against the documents in AWS S3 and exit'
+    )
+    parser.add_argument(
+        '--check-only',
+        action='store_true',
+        help='Check the rows of all workbooks for the problems a run would report, without a database or AWS, and exit'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Apply only the changes to the existing local database instead of rebuilding it'
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help='Path to which run metrics are also written in the Prometheus text format'
+    )
+    profile_group = parser.add_mutually_exclusive_group()
+    profile_group.add_argument(
+        '--profile',
+        dest='profile_mode',
+        action='store_const',
+        const=Profiler.MODE_DETERMINISTIC,
+        help='Write a cProfile profile of each phase of the run to ./logs'
+    )
+    profile_group.add_argument(
+        '--profile-sample',
+        dest='profile_mode',
+        action='store_const',
+        const=Profiler.MODE_SAMPLING,
+        help='Sample stacks of every thread during the run and write them as collapsed stacks to ./logs'
+    )
+    parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted per statement')
+    parser.add_argument(
+        '--load-mode',
+        choices=[Migrator.LOAD_MODE_INSERT, Migrator.LOAD_MODE_INFILE],
+        default=Migrator.LOAD_MODE_INSERT,
+        help='Whether to insert rows in batches or bulk load them with LOAD DATA LOCAL INFILE'
+    )
+    parser.add_argument(
+        '--promote-mode',
+        choices=[PROMOTE_MODE_DUMP, PROMOTE_MODE_INCREMENTAL, PROMOTE_MODE_PARALLEL, PROMOTE_MODE_SHADOW],
+        default=PROMOTE_MODE_DUMP,
+        help=(
+            'Whether to promote a full dump of the local database, only the rows which differ from production, '
+            'a full dump streamed table by table in parallel, or a parallel dump into a shadow database which is '
+            'then atomically swapped into production'
+        )
+    )
+    parser.add_argument(
+        '--promote-workers',
+        type=int,
+        default=4,
+        help='Number of tables streamed concurrently; requires --promote-mode=parallel or shadow'
+    )
+    parser.add_argument(
+        '--rollback-prod',
+        action='store_true',
+        help='Swap the tables replaced by the last shadow promotion back into production and exit'
+    )
+    parser.add_argument(
+        '--promote-dry-run',
+        action='store_true',
+        help='Only report the rows which differ from production; requires --promote-mode=incremental'
+    )
     return parser.parse_args()
 
 
-def _migrate_prod(local_database):
+def _input_prod_database():
     match = None
     while match is None:
         database_url_input = input('Please enter production database URL: ')
@@ -45,41 +125,101 @@ def _migrate_prod(local_database):
         if match is None:
             print("Invalid database URL, please try again.")
     user, password, host, port, database = match.groups()
+    return URL('mysql+pymysql', username=user, password=password, host=host, port=int(port), database=database)
+
+
+def _confirm_problems(violation_count):
+    answer = input('Validation found {} problems in the shadow database. Swap it into production? [Y/n]: '.format(
+        violation_count
+    ))
+    return answer == 'Y'
+
+
+def _rollback_prod():
+    ShadowPromoter(_input_prod_database()).rollback()
+
+
+def _migrate_prod(validate, local_database, promote_mode, dry_run, batch_size, workers):
+    production_db_url = _input_prod_database()
+
+    if promote_mode == PROMOTE_MODE_INCREMENTAL:
+        promoter = IncrementalPromoter(LOCAL_DATABASE_URL + local_database, production_db_url, batch_size)
+        promoter.promote(dry_run)
+        if dry_run:
+            logger.info('Dry run completed; production was not modified.')
+        else:
+            logger.info('Successfully promoted data to production.')
+        return
+
+    if promote_mode == PROMOTE_MODE_SHADOW:
+        promoter = ShadowPromoter(production_db_url)
+        promoter.promote(
+            LOCAL_DATABASE_URL + local_database, local_database, workers, validate, _confirm_problems
+        )
+        logger.info('Successfully promoted data to production.')
+        return
+
+    mysql_args = get_mysql_args(production_db_url)
+
+    if promote_mode == PROMOTE_MODE_PARALLEL:
+        promoter = ParallelDumpPromoter(LOCAL_DATABASE_URL + local_database, local_database, mysql_args, workers)
+        promoter.promote()
+        logger.info('Successfully promoted data to production.')
+        return
 
     mysqldump_process = subprocess.Popen(
         ['mysqldump', local_database, '-u', 'root'],
         stdout=subprocess.PIPE,
     )
-
-    # TODO: avoid passing MySQL password through CLI.
-    mysql_args = [
-        'mysql',
-        '--user={}'.format(user),
-        '--password={}'.format(password),
-        '--host={}'.format(host),
-        '--port={}'.format(port),
-        '--database={}'.format(database),
-    ]
     subprocess.run(mysql_args, stdin=mysqldump_process.stdout, check=True)
 
     logger.info('Successfully promoted data to production.')
 
 
 if __name__ == '__main__':
-    _init_db()
-
+    init_logger()
     args = _parse_args()
     migrator = Migrator(
         args.data,
         args.documents,
-        LOCAL_DATABASE_URL + args.db,
-        args.upload
+        LOCAL_DATABASE_URL + (args.db or ''),
+        args.upload,
+        args.upload_workers,
+        args.batch_size,
+        args.load_mode,
+        args.incremental,
+        args.metrics_textfile,
+        args.profile_mode
     )
 
+    if args.check_only:
+        sys.exit(1 if migrator.check() else 0)
+
+    if args.verify_manifest:
+        migrator.verify_manifest()
+        sys.exit()
+
+    if args.rollback_prod:
+        _rollback_prod()
+        sys.exit()
+
+    # Workbooks are checked before the local database is touched, since a run rebuilds it.
+    problem_count = migrator.check()
+    if problem_count:
+        continue_migration = input('Check found {} problems in the workbooks. Migrate anyway? [Y/n]: '.format(
+            problem_count
+        ))
+        if continue_migration != 'Y':
+            sys.exit(1)
+
+    if not args.incremental:
+        _init_db()
     migrator.run()
 
     migrate_prod = input('Promote data to production? [Y/n]: ')
     if migrate_prod == 'Y':
-        _migrate_prod(args.db)
+        _migrate_prod(
+            migrator.validate, args.db, args.promote_mode, args.promote_dry_run, args.batch_size, args.promote_workers
+        )
 
     logger.info('Script completed without errors.')
@@ -1,20 +1,41 @@
+import hashlib
+import os
 import re
 
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
 
 
 class S3Client:
 
-    def __init__(self, bucket):
+    OBJECT_MISSING = 'missing'
+    OBJECT_CHANGED = 'changed'
+    OBJECT_UNCHANGED = 'unchanged'
+
+    # Uploads are split into parts of this size; S3 derives the ETag of multipart uploads from the parts, so
+    # local ETags can only be computed if the part size is fixed.
+    _MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket, session=None):
         self._bucket = bucket
-        session = boto3.Session(profile_name='migration')
+        if session is None:
+            session = boto3.Session(profile_name='migration')
         self._s3_client = session.client('s3')
         self._s3_client_url_generator = session.client(
             's3',
             config=botocore.client.Config(signature_version=botocore.UNSIGNED)
         )
 
+        # Mapping from object key to (size, ETag) for objects under the indexed prefix; see build_index.
+        self._index = None
+        self._index_prefix = None
+
+        self._transfer_config = TransferConfig(
+            multipart_threshold=self._MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=self._MULTIPART_CHUNK_SIZE,
+        )
+
     def generate_s3_key(self, segments, file_type):
         escaped_segments = []
         for segment in segments:
@@ -38,25 +59,102 @@ class S3Client:
             }
         )
 
+    def list_objects(self, prefix):
+        """Return mapping from key to (size, ETag) of all objects under given prefix."""
+        objects = {}
+        paginator = self._s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            for s3_object in page.get('Contents', []):
+                objects[s3_object['Key']] = (s3_object['Size'], s3_object['ETag'].strip('"'))
+        return objects
+
+    def build_index(self, prefix):
+        """List all objects under given prefix so that existence checks for their keys need no requests."""
+        self._index = self.list_objects(prefix)
+        self._index_prefix = prefix
+        return len(self._index)
+
     def object_exists(self, key):
         """Return True if object with given key exists."""
-        try:
-            self._s3_client.get_object(
-                Bucket=self._bucket,
-                Key=key,
+        return self._get_remote_object(key) is not None
+
+    def hash_file(self, file_path):
+        """Return tuple of the S3 ETag and SHA-256 of file at given local path, reading the file once."""
+        sha256 = hashlib.sha256()
+        part_md5s = []
+        size = 0
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(self._MULTIPART_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                part_md5s.append(hashlib.md5(chunk))
+                size += len(chunk)
+
+        # Objects uploaded in a single part have the MD5 of their content as ETag; multipart objects have the MD5
+        # of their concatenated part MD5s, suffixed by the number of parts.
+        if size < self._MULTIPART_CHUNK_SIZE:
+            etag = part_md5s[0].hexdigest() if part_md5s else hashlib.md5().hexdigest()
+        else:
+            etag = '{}-{}'.format(
+                hashlib.md5(b''.join(part_md5.digest() for part_md5 in part_md5s)).hexdigest(),
+                len(part_md5s)
             )
-            return True
-        except self._s3_client.exceptions.NoSuchKey:
-            return False
 
-    def upload_pdf(self, file_path, key):
+        return etag, sha256.hexdigest()
+
+    def get_object_status(self, key, file_hashes):
+        """Compare object with given key against local file with given hashes (see hash_file)."""
+        remote_object = self._get_remote_object(key)
+        if remote_object is None:
+            return self.OBJECT_MISSING
+
+        _, remote_etag, remote_sha256 = remote_object
+        etag, sha256 = file_hashes
+
+        # Prefer the stored SHA-256 since ETags depend on how the object was uploaded.
+        if remote_sha256 is not None:
+            is_unchanged = remote_sha256 == sha256
+        else:
+            is_unchanged = remote_etag == etag
+
+        return self.OBJECT_UNCHANGED if is_unchanged else self.OBJECT_CHANGED
+
+    def upload_pdf(self, file_path, key, file_hashes=None):
         """Upload PDF at given local path to S3 under given key."""
+        if file_hashes is None:
+            file_hashes = self.hash_file(file_path)
+        etag, sha256 = file_hashes
+
         self._s3_client.upload_file(
             file_path,
             self._bucket,
             key,
             ExtraArgs={
                 'ContentDisposition': 'inline',
-                'ContentType': 'application/pdf'
+                'ContentType': 'application/pdf',
+                'Metadata': {'sha256': sha256},
             },
+            Config=self._transfer_config,
         )
+
+        if self._index is not None and key.startswith(self._index_prefix):
+            self._index[key] = (os.path.getsize(file_path), etag)
+
+    def _get_remote_object(self, key):
+        """Return tuple of size, ETag and stored SHA-256 (if known) of object with given key, or None if missing."""
+        if self._index is not None and key.startswith(self._index_prefix):
+            if key not in self._index:
+                return None
+            size, etag = self._index[key]
+            return size, etag, None
+
+        try:
+            response = self._s3_client.head_object(
+                Bucket=self._bucket,
+                Key=key,
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == '404':
+                return None
+            raise
+
+        return response['ContentLength'], response['ETag'].strip('"'), response['Metadata'].get('sha256')
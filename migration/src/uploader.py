@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore
+
+from logger import logger
+
+
+class DocumentUploader:
+    """
+    Uploads documents to S3 on a bounded pool of worker threads, retrying failed uploads with backoff. Documents
+    recorded as unchanged in the upload manifest are skipped without any requests.
+    """
+
+    _MAX_ATTEMPTS = 5
+
+    # Transfers wrap client errors of the upload itself in S3UploadFailedError, which is not a ClientError.
+    _RETRIED_ERRORS = (
+        botocore.exceptions.BotoCoreError,
+        botocore.exceptions.ClientError,
+        boto3.exceptions.S3UploadFailedError,
+    )
+    _BACKOFF_SECONDS = 1
+
+    def __init__(self, s3_client, manifest, max_workers, metrics=None):
+        self._s3_client = s3_client
+        self._manifest = manifest
+        self._metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+
+        # Several authorities may share a document under the same key; each key is only uploaded once.
+        self._submitted_keys = set()
+        self._futures = []
+
+        self._lock = threading.Lock()
+        self._uploaded = []
+        self._changed = []
+        self._skipped = []
+
+    def submit(self, serial, document_file, key):
+        """Queue upload of given document file; returns immediately."""
+        if key in self._submitted_keys:
+            return
+        self._submitted_keys.add(key)
+
+        if self._manifest.is_unchanged(key, document_file):
+            logger.debug('Document: %s will not be uploaded since it has not changed since its last upload.', serial)
+            with self._lock:
+                self._skipped.append((serial, key))
+            return
+
+        future = self._executor.submit(self._upload, serial, document_file, key)
+        self._futures.append((serial, key, future))
+
+    def wait(self):
+        """Wait for all queued uploads to complete. Returns list of (serial, key, error) for failed uploads."""
+        failures = []
+        for serial, key, future in self._futures:
+            error = future.exception()
+            if error is not None:
+                failures.append((serial, key, error))
+        self._executor.shutdown()
+
+        for serial, key in self._changed:
+            logger.info('Document: %s changed and was re-uploaded to: %s', serial, key)
+        for serial, key, error in failures:
+            logger.warning('Document: %s failed to upload to: %s (%s)', serial, key, error)
+        logger.info(
+            'Documents uploaded: %d, re-uploaded: %d, unchanged: %d, failed: %d.',
+            len(self._uploaded), len(self._changed), len(self._skipped), len(failures)
+        )
+
+        return failures
+
+    def cancel(self):
+        """Cancel queued uploads and wait for those in progress, e.g. when the run fails before waiting for them."""
+        cancelled_count = sum(future.cancel() for _, _, future in self._futures)
+        self._executor.shutdown()
+        if cancelled_count:
+            logger.warning('Uploads of %d documents were cancelled.', cancelled_count)
+
+    def _upload(self, serial, document_file, key):
+        start_time = time.monotonic()
+        try:
+            for attempt in range(1, self._MAX_ATTEMPTS + 1):
+                try:
+                    self._upload_once(serial, document_file, key)
+                    return
+                except self._RETRIED_ERRORS as error:
+                    if attempt == self._MAX_ATTEMPTS:
+                        raise
+                    delay = self._BACKOFF_SECONDS * 2 ** (attempt - 1)
+                    logger.debug(
+                        'Document: %s upload attempt %d failed (%s), retrying in %ds.',
+                        serial, attempt, error, delay
+                    )
+                    time.sleep(delay)
+        finally:
+            if self._metrics is not None:
+                self._metrics.record_s3_seconds(time.monotonic() - start_time)
+
+    def _upload_once(self, serial, document_file, key):
+        # Compare file against the existing object to avoid unnecessary writes while still replacing corrected files.
+        file_hashes = self._s3_client.hash_file(document_file.path)
+        status = self._s3_client.get_object_status(key, file_hashes)
+
+        if status == self._s3_client.OBJECT_UNCHANGED:
+            logger.debug('Document: %s will not be uploaded since it is unchanged.', serial)
+            self._manifest.record(key, document_file, file_hashes)
+            with self._lock:
+                self._skipped.append((serial, key))
+            return
+
+        self._s3_client.upload_pdf(document_file.path, key, file_hashes)
+        self._manifest.record(key, document_file, file_hashes)
+        logger.debug('Document: %s successfully uploaded to: %s', serial, key)
+        with self._lock:
+            if status == self._s3_client.OBJECT_CHANGED:
+                self._changed.append((serial, key))
+            else:
+                self._uploaded.append((serial, key))
@@ -1,7 +1,15 @@
 import datetime
+import functools
 import re
 
+_ISO_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+_US_DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
 
+# Normalized strings repeat across rows (keywords, jurisdictions, tags), so results are memoized.
+_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE)
 def format_as_id(name):
     """Formats string to an appropriate ID."""
     return (
@@ -15,6 +23,7 @@ def format_as_id(name):
     )
 
 
+@functools.lru_cache(maxsize=_CACHE_SIZE)
 def format_as_keyword(name):
     """Formats string to an appropriate keyword."""
     formatted = format_string(name)
@@ -56,31 +65,28 @@ def format_string(string):
 
 def format_date(date):
     """Format date string into SQL-compatible date."""
-    if isinstance(date, datetime.datetime):
-        return date
-    elif date is None or date == '':
-        return None
-    elif re.match(r'\d{4}-\d{2}-\d{2}', date) is not None:
-        # Date is already in valid format.
-        return date
-    else:
-        match = re.match(r'(\d{1,2})/(\d{1,2})/(\d{4})', date)
-        if match is not None and len(match.groups()) == 3:
-            (month, day, year) = match.groups()
-            return "{}-{}-{}".format(year, month, day)
-        else:
-            raise ValueError('Invalid date: {}'.format(date))
+    return parse_date(date)[0]
 
 
 def get_year_from_date(date):
     """Get year from date; note that date may be one of many types or formats."""
+    return parse_date(date)[1]
+
+
+# Not memoized: most dates are distinct, so a cache would mostly miss.
+def parse_date(date):
+    """Parse date into tuple of SQL-compatible date and year; note that date may be one of many types or formats."""
     if isinstance(date, datetime.datetime):
-        return str(date.year)
+        return date, str(date.year)
     elif date is None or date == '':
-        return None
-    elif re.match(r'\d{4}-\d{2}-\d{2}', date) is not None:
-        return date[:4]
-    elif re.match(r'\d{1,2}/\d{1,2}/\d{4}', date) is not None:
-        return date[-4:]
+        return None, None
+    elif _ISO_DATE_PATTERN.match(date) is not None:
+        # Date is already in valid format.
+        return date, date[:4]
     else:
-        raise ValueError('Invalid date: {}'.format(date))
+        match = _US_DATE_PATTERN.match(date)
+        if match is not None:
+            (month, day, year) = match.groups()
+            return "{}-{}-{}".format(year, month, day), date[-4:]
+        else:
+            raise ValueError('Invalid date: {}'.format(date))
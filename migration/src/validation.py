@@ -0,0 +1,130 @@
+import collections
+
+import sqlalchemy
+
+from logger import logger
+
+# Check evaluated for every row of a table, on the number of rows of another table which reference the row's key
+# through given column and have given (column, value) pairs. The message is a %-format string with the label of the
+# row and the count as named arguments.
+Rule = collections.namedtuple(
+    'Rule', ['table', 'key_column', 'count_table', 'count_column', 'count_values', 'is_violation', 'message']
+)
+
+RULES = [
+    Rule(
+        'authority', 'authorityId', 'authorityDocument', 'authorityId', (('isPrimary', 1),),
+        lambda count: count != 1,
+        'Authority: %(label)s has %(value)d primary documents.'
+    ),
+    Rule(
+        'authority', 'authorityId', 'authorityKeywords', 'authorityId', (),
+        lambda count: count == 0,
+        'Authority: %(label)s does not have any keywords.'
+    ),
+    Rule(
+        'inquest', 'inquestId', 'inquestDocument', 'inquestId', (),
+        lambda count: count == 0,
+        'Inquest: %(label)s does not have any documents.'
+    ),
+    Rule(
+        'inquest', 'inquestId', 'inquestKeywords', 'inquestId', (),
+        lambda count: count == 0,
+        'Inquest: %(label)s does not have any keywords.'
+    ),
+    Rule(
+        'authorityKeyword', 'authorityKeywordId', 'authorityKeywords', 'authorityKeywordId', (),
+        lambda count: count == 0,
+        'Authority keyword: %(label)s is not used by any authority.'
+    ),
+    Rule(
+        'inquestKeyword', 'inquestKeywordId', 'inquestKeywords', 'inquestKeywordId', (),
+        lambda count: count == 0,
+        'Inquest keyword: %(label)s is not used by any inquest.'
+    ),
+]
+
+
+class Validator:
+    """Evaluates rules with one query per table, so that adding a rule does not add another scan of its table."""
+
+    def __init__(self, rules):
+        self._rules = _group_rules(rules)
+
+    def validate(self, session, labels):
+        """
+        Log a warning for every violated rule. Given mapping from table to mapping from key to label is used to
+        identify rows in warnings; rows of other tables are identified by key. Returns number of violations.
+        """
+        violation_count = 0
+
+        for (table, key_column), rules in self._rules.items():
+            query = sqlalchemy.text('SELECT {0}.{1}, {2} FROM {0} ORDER BY {0}.{1}'.format(
+                table, key_column, ', '.join('({})'.format(_count_query(rule)) for rule in rules)
+            ))
+            for row in session.execute(query):
+                violation_count += _report_violations(rules, labels.get(table, {}), row[0], row[1:])
+
+        return violation_count
+
+
+class MemoryValidator:
+    """
+    Evaluates rules on rows as they are added, for checks without a database. Used as a writer; rows are not kept,
+    only the keys of checked tables and the counts of referencing rows.
+    """
+
+    def __init__(self, rules):
+        self._rules = _group_rules(rules)
+        self._keys = collections.defaultdict(set)
+        self._counts = collections.defaultdict(collections.Counter)
+
+    def add(self, model, **values):
+        table = model.__tablename__
+        for (rule_table, key_column), rules in self._rules.items():
+            if table == rule_table:
+                self._keys[rule_table].add(values[key_column])
+            for rule in rules:
+                if table != rule.count_table:
+                    continue
+                if all(values[column] == value for column, value in rule.count_values):
+                    self._counts[rule][values[rule.count_column]] += 1
+
+    def flush(self):
+        pass
+
+    def validate(self, labels):
+        """Log a warning for every violated rule, like Validator.validate. Returns number of violations."""
+        violation_count = 0
+
+        for (table, _), rules in self._rules.items():
+            for key in sorted(self._keys[table]):
+                values = [self._counts[rule][key] for rule in rules]
+                violation_count += _report_violations(rules, labels.get(table, {}), key, values)
+
+        return violation_count
+
+
+def _group_rules(rules):
+    """Group rules by table and key column, in order of their first rule."""
+    grouped_rules = collections.OrderedDict()
+    for rule in rules:
+        grouped_rules.setdefault((rule.table, rule.key_column), []).append(rule)
+    return grouped_rules
+
+
+def _count_query(rule):
+    conditions = ['{0}.{1} = {2}.{3}'.format(rule.count_table, rule.count_column, rule.table, rule.key_column)]
+    conditions.extend(
+        '{}.{} = {:d}'.format(rule.count_table, column, value) for column, value in rule.count_values
+    )
+    return 'SELECT COUNT(*) FROM {} WHERE {}'.format(rule.count_table, ' AND '.join(conditions))
+
+
+def _report_violations(rules, table_labels, key, values):
+    violation_count = 0
+    for rule, value in zip(rules, values):
+        if rule.is_violation(value):
+            violation_count += 1
+            logger.warning(rule.message, {'label': table_labels.get(key, key), 'value': value})
+    return violation_count
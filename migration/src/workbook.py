@@ -0,0 +1,124 @@
+import glob
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import load_workbook
+
+from logger import logger
+
+
+class WorkbookReader:
+    """Reads rows from Caspio Excel exports, caching parsed rows on disk."""
+
+    # Bump whenever the format of cached rows changes so that stale caches are ignored.
+    READER_VERSION = 1
+
+    # Number of rows pickled together; rows are cached in batches so that they can still be streamed back.
+    _CACHE_BATCH_SIZE = 1000
+
+    def __init__(self, data_directory):
+        self._data_directory = data_directory
+        self._cache_directory = os.path.join(data_directory, '.cache')
+
+    def read(self, workbook):
+        """Yields rows in given Excel file, from the cache if the file has not changed since it was last parsed."""
+        file_path = self._get_workbook_path(workbook)
+        cache_path = self._get_cache_path(workbook, self._hash_file(file_path))
+
+        if os.path.isfile(cache_path):
+            logger.debug('Workbook: %s loaded from cache.', workbook)
+            return self._read_cache(cache_path)
+
+        return self._read_and_cache_workbook(workbook, file_path, cache_path)
+
+    def prefetch(self, workbooks):
+        """Parse given workbooks which are not cached yet, each in a separate process, and cache their rows."""
+        uncached_workbooks = [
+            workbook for workbook in workbooks
+            if not os.path.isfile(self._get_cache_path(workbook, self._hash_file(self._get_workbook_path(workbook))))
+        ]
+        if not uncached_workbooks:
+            return
+
+        # Rows are handed back through the cache files, which are read back far faster than the workbooks parse.
+        with ProcessPoolExecutor(max_workers=len(uncached_workbooks)) as executor:
+            futures = [
+                executor.submit(_cache_workbook, self._data_directory, workbook) for workbook in uncached_workbooks
+            ]
+            for workbook, future in zip(uncached_workbooks, futures):
+                logger.debug('Workbook: %s parsed %d rows.', workbook, future.result())
+
+    def _get_workbook_path(self, workbook):
+        return os.path.join(self._data_directory, 'caspio_{}.xlsx'.format(workbook))
+
+    def _get_cache_path(self, workbook, file_hash):
+        return os.path.join(
+            self._cache_directory,
+            'caspio_{}-{}-v{}.pickle'.format(workbook, file_hash, self.READER_VERSION)
+        )
+
+    def _hash_file(self, file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _read_cache(self, cache_path):
+        with open(cache_path, 'rb') as cache_file:
+            while True:
+                try:
+                    rows = pickle.load(cache_file)
+                except EOFError:
+                    return
+                yield from rows
+
+    def _read_and_cache_workbook(self, workbook, file_path, cache_path):
+        os.makedirs(self._cache_directory, exist_ok=True)
+
+        # Write to a temporary file first so that an interrupted read never leaves a partial cache behind.
+        temp_cache_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(temp_cache_path, 'wb') as cache_file:
+            try:
+                rows = []
+                for row in self._parse_workbook(file_path):
+                    rows.append(row)
+                    if len(rows) >= self._CACHE_BATCH_SIZE:
+                        pickle.dump(rows, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+                        rows = []
+                    yield row
+                if rows:
+                    pickle.dump(rows, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            except BaseException:
+                cache_file.close()
+                os.remove(temp_cache_path)
+                raise
+
+        # Remove caches of previous versions of this workbook before publishing the new one.
+        for stale_cache_path in glob.glob(os.path.join(self._cache_directory, 'caspio_{}-*.pickle'.format(workbook))):
+            os.remove(stale_cache_path)
+        os.replace(temp_cache_path, cache_path)
+        logger.debug('Workbook: %s cached to: %s', workbook, cache_path)
+
+    def _parse_workbook(self, file_path):
+        # Read-only mode parses worksheets lazily rather than building every cell up front, which keeps memory
+        # flat as the sheets grow. Such workbooks hold the file open until explicitly closed.
+        work_book = load_workbook(file_path, read_only=True)
+        try:
+            work_sheet = work_book.active
+
+            # Start at 2nd row to ignore headers.
+            for row in work_sheet.iter_rows(min_row=2, values_only=True):
+                # Read-only mode trusts the dimensions recorded in the file, which may include trailing blank rows.
+                if not any(value is not None for value in row):
+                    continue
+                yield row
+        finally:
+            work_book.close()
+
+
+def _cache_workbook(data_directory, workbook):
+    """Parse and cache given workbook; runs in a worker process. Returns number of rows."""
+    return sum(1 for _ in WorkbookReader(data_directory).read(workbook))
@@ -0,0 +1,137 @@
+import collections
+import datetime
+import os
+import shutil
+import tempfile
+import weakref
+
+import sqlalchemy
+
+
+class BulkWriter:
+    """Buffers rows per model and inserts them in batches with multi-row INSERT statements."""
+
+    def __init__(self, session, batch_size):
+        self._session = session
+        self._batch_size = batch_size
+
+        # Mapping from model to its buffered rows. Models are flushed in the order they were first added, which
+        # is the order in which the migrator satisfies FK constraints.
+        self._rows = {}
+
+    def add(self, model, **values):
+        """Buffer row for given model; all rows of a model must set the same columns."""
+        rows = self._rows.setdefault(model, [])
+        rows.append(values)
+
+        if len(rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert all buffered rows."""
+        # Buffers of every model are flushed together so that rows are never inserted before the rows they
+        # reference.
+        for model, rows in self._rows.items():
+            if not rows:
+                continue
+            # Passing a list of rows results in a single executemany call, which the driver sends as multi-row
+            # INSERT ... VALUES statements.
+            self._session.execute(model.__table__.insert(), rows)
+            self._rows[model] = []
+
+
+class InfileWriter:
+    """
+    Spools rows per model into TSV files and bulk loads them with LOAD DATA LOCAL INFILE. Note that LOCAL implies
+    IGNORE, so MySQL skips rows with duplicate keys and truncates or coerces invalid values with a warning instead of
+    failing like an INSERT in strict mode; flush therefore fails if a load has warnings or skips rows.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self._spool_directory = tempfile.mkdtemp(prefix='inquestsca-')
+
+        # Mapping from model to its spool file and columns. Models are loaded in the order they were first added,
+        # which is the order in which the migrator satisfies FK constraints.
+        self._spools = {}
+        self._row_counts = collections.Counter()
+
+        # Spool files are also removed if the phase fails before they are loaded.
+        self._remove_spools = weakref.finalize(self, _remove_spools, self._spools, self._spool_directory)
+
+    def add(self, model, **values):
+        """Spool row for given model; all rows of a model must set the same columns."""
+        if model not in self._spools:
+            spool_path = os.path.join(self._spool_directory, '{}.tsv'.format(model.__tablename__))
+            spool_file = open(spool_path, 'w', encoding='utf-8', newline='')
+            self._spools[model] = (spool_file, list(values))
+
+        spool_file, columns = self._spools[model]
+        spool_file.write('\t'.join(self._format_value(values[column]) for column in columns))
+        spool_file.write('\n')
+        self._row_counts[model] += 1
+
+    def flush(self):
+        """Load all spooled rows and remove the spool files."""
+        try:
+            # Checks are disabled for the current connection only; rows are already validated by the migrator. Without
+            # unique checks, InnoDB may also accept duplicates in secondary unique indexes, which the checks below
+            # cannot detect.
+            self._session.execute(sqlalchemy.text('SET FOREIGN_KEY_CHECKS = 0'))
+            self._session.execute(sqlalchemy.text('SET UNIQUE_CHECKS = 0'))
+
+            for model, (spool_file, columns) in self._spools.items():
+                spool_file.close()
+                result = self._session.execute(
+                    sqlalchemy.text("""
+                        LOAD DATA LOCAL INFILE :path
+                        INTO TABLE `{}`
+                        CHARACTER SET utf8
+                        FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                        LINES TERMINATED BY '\\n'
+                        ({})
+                    """.format(model.__tablename__, ', '.join('`{}`'.format(column) for column in columns))),
+                    {'path': spool_file.name}
+                )
+                self._check_warnings(model)
+                if result.rowcount != self._row_counts[model]:
+                    raise RuntimeError('Table: {} loaded {} of {} rows; duplicate keys were skipped.'.format(
+                        model.__tablename__, result.rowcount, self._row_counts[model]
+                    ))
+        finally:
+            self._session.execute(sqlalchemy.text('SET UNIQUE_CHECKS = 1'))
+            self._session.execute(sqlalchemy.text('SET FOREIGN_KEY_CHECKS = 1'))
+            self._remove_spools()
+            self._row_counts.clear()
+
+    def _check_warnings(self, model):
+        warning_count = self._session.execute(sqlalchemy.text('SHOW COUNT(*) WARNINGS')).scalar()
+        if warning_count:
+            warnings = self._session.execute(sqlalchemy.text('SHOW WARNINGS LIMIT 3')).fetchall()
+            raise RuntimeError('Table: {} was loaded with {} warnings, including: {}'.format(
+                model.__tablename__, warning_count, '; '.join(message for _, _, message in warnings)
+            ))
+
+    def _format_value(self, value):
+        """Format value as a TSV field the same way the driver would format it as an SQL literal."""
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(' ')
+        return (
+            str(value)
+                .replace('\\', '\\\\')
+                .replace('\0', '\\0')
+                .replace('\t', '\\t')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r')
+        )
+
+
+def _remove_spools(spools, spool_directory):
+    for spool_file, _ in spools.values():
+        spool_file.close()
+    spools.clear()
+    shutil.rmtree(spool_directory, ignore_errors=True)
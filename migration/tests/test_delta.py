@@ -0,0 +1,101 @@
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+import models
+from delta import DeltaWriter
+
+
+@compiles(TINYINT, 'sqlite')
+def _compile_tinyint(type_, compiler, **kwargs):
+    return 'INTEGER'
+
+
+_SOURCES = [
+    {'sourceId': 'CAN_ON', 'jurisdictionId': 'CAN_ON', 'name': 'Ontario', 'code': 'ON', 'rank': 1},
+    {'sourceId': 'CAN_BC', 'jurisdictionId': 'CAN_BC', 'name': 'British Columbia', 'code': 'BC', 'rank': 2},
+    {'sourceId': 'CAN_AB', 'jurisdictionId': 'CAN_AB', 'name': 'Alberta', 'code': 'AB', 'rank': 3},
+]
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine('sqlite://')
+    models.metadata.create_all(engine)
+    return engine
+
+
+def _apply(engine, sources):
+    """Apply given sources with a new writer; returns statements which modified the database."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    writer = DeltaWriter(batch_size=2)
+    for source in sources:
+        writer.add(models.Source, **source)
+    writer.flush()
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', record_statement)
+    try:
+        session = sessionmaker(bind=engine)()
+        writer.apply(session)
+        session.commit()
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', record_statement)
+
+    return statements
+
+
+def _get_sources(engine):
+    rows = engine.execute(sqlalchemy.select([models.Source.__table__]).order_by('sourceId'))
+    return [dict(row) for row in rows]
+
+
+def test_unchanged_rows_are_not_written_again(engine):
+    _apply(engine, _SOURCES)
+
+    assert _apply(engine, _SOURCES) == []
+    assert _get_sources(engine) == sorted(_SOURCES, key=lambda source: source['sourceId'])
+
+
+def test_inserted_row_is_applied(engine):
+    _apply(engine, _SOURCES[:2])
+
+    statements = _apply(engine, _SOURCES)
+
+    assert len(statements) == 1 and statements[0].startswith('INSERT')
+    assert _get_sources(engine) == sorted(_SOURCES, key=lambda source: source['sourceId'])
+
+
+def test_updated_row_is_applied(engine):
+    _apply(engine, _SOURCES)
+    updated_source = dict(_SOURCES[1], name='British Columbia Coroners Service', rank=5)
+
+    statements = _apply(engine, [_SOURCES[0], updated_source, _SOURCES[2]])
+
+    assert len(statements) == 1 and statements[0].startswith('UPDATE')
+    assert _get_sources(engine) == sorted(
+        [_SOURCES[0], updated_source, _SOURCES[2]], key=lambda source: source['sourceId']
+    )
+
+
+def test_deleted_row_is_applied(engine):
+    _apply(engine, _SOURCES)
+
+    statements = _apply(engine, [_SOURCES[0], _SOURCES[2]])
+
+    assert len(statements) == 1 and statements[0].startswith('DELETE')
+    assert _get_sources(engine) == sorted([_SOURCES[0], _SOURCES[2]], key=lambda source: source['sourceId'])
+
+
+def test_duplicate_key_is_rejected():
+    writer = DeltaWriter(batch_size=2)
+    writer.add(models.Source, **_SOURCES[0])
+
+    with pytest.raises(ValueError, match='duplicate key'):
+        writer.add(models.Source, **dict(_SOURCES[0], name='Ontario Coroner'))
@@ -0,0 +1,29 @@
+import os
+
+from documents import DocumentFileIndex
+
+
+def test_files_are_indexed_by_document_serial(tmp_path):
+    (tmp_path / 'DOC1').mkdir()
+    (tmp_path / 'DOC1' / 'report.pdf').write_bytes(b'%PDF')
+    (tmp_path / 'DOC2').mkdir()
+
+    index = DocumentFileIndex(str(tmp_path))
+
+    assert len(index) == 2
+    assert [(os.path.basename(document.path), document.size) for document in index.get_files(' DOC1 ')] == [
+        ('report.pdf', 4)
+    ]
+    assert index.get_files('DOC2') == []
+    assert index.get_files('DOC3') == []
+
+
+def test_broken_symlink_is_skipped(tmp_path, caplog):
+    (tmp_path / 'DOC1').mkdir()
+    (tmp_path / 'DOC1' / 'report.pdf').write_bytes(b'%PDF')
+    os.symlink(str(tmp_path / 'missing.pdf'), str(tmp_path / 'DOC1' / 'broken.pdf'))
+
+    index = DocumentFileIndex(str(tmp_path))
+
+    assert [os.path.basename(document.path) for document in index.get_files('DOC1')] == ['report.pdf']
+    assert 'broken.pdf cannot be read' in caplog.text
@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import models
+from pipeline import Pipeline
+
+
+class _RecordingWriter:
+
+    def __init__(self, fail_on_add=None, fail_on_flush=False):
+        self.rows = []
+        self.flushed = False
+        self._fail_on_add = fail_on_add
+        self._fail_on_flush = fail_on_flush
+
+    def add(self, model, **values):
+        if len(self.rows) == self._fail_on_add:
+            raise ValueError('add failed')
+        self.rows.append((model, values))
+
+    def flush(self):
+        if self._fail_on_flush:
+            raise ValueError('flush failed')
+        self.flushed = True
+
+
+def _write(pipeline, writer, row_count):
+    """Write rows through given pipeline on another thread, so that a hanging pipeline fails the test."""
+    errors = []
+
+    def write_rows():
+        try:
+            pipelined_writer = pipeline.write(writer)
+            for row in pipeline.read(iter(range(row_count))):
+                pipelined_writer.add(models.Source, sourceId=str(row))
+            pipelined_writer.flush()
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=write_rows, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), 'Pipeline did not finish.'
+
+    if errors:
+        raise errors[0]
+
+
+def test_rows_are_written_in_order_and_flushed():
+    writer = _RecordingWriter()
+    _write(Pipeline('test', queue_size=2), writer, 1050)
+
+    assert [values['sourceId'] for _, values in writer.rows] == [str(row) for row in range(1050)]
+    assert writer.flushed
+
+
+def test_error_during_add_is_raised_by_flush():
+    writer = _RecordingWriter(fail_on_add=550)
+    with pytest.raises(ValueError, match='add failed'):
+        _write(Pipeline('test', queue_size=2), writer, 10000)
+
+    assert not writer.flushed
+
+
+def test_error_during_flush_is_raised_by_flush():
+    writer = _RecordingWriter(fail_on_flush=True)
+    with pytest.raises(ValueError, match='flush failed'):
+        _write(Pipeline('test', queue_size=2), writer, 10)
+
+
+def test_error_while_reading_is_raised_to_consumer():
+    def rows():
+        yield 1
+        raise KeyError('read failed')
+
+    with pytest.raises(KeyError, match='read failed'):
+        list(Pipeline('test', queue_size=2).read(rows()))
+
+
+def test_reader_stops_when_rows_are_not_consumed():
+    rows = Pipeline('test', queue_size=2).read(iter(range(100000)))
+    assert next(rows) == 0
+    rows.close()
+
+
+class _SlowWriter(_RecordingWriter):
+
+    def add(self, model, **values):
+        time.sleep(0.0002)
+        super().add(model, **values)
+
+
+def test_slow_writer_is_reported_as_limit(caplog):
+    # Every row fits in the queue, so the transformer only waits for the writer when flushing.
+    pipeline = Pipeline('test', queue_size=100)
+    _write(pipeline, _SlowWriter(), 3000)
+
+    with caplog.at_level(logging.INFO, logger='migration'):
+        pipeline.log()
+
+    assert 'limited by writer' in caplog.text
@@ -0,0 +1,109 @@
+import threading
+
+import boto3
+import botocore
+import moto
+import pytest
+
+import uploader
+from documents import DocumentFile
+from manifest import UploadManifest
+from s3 import S3Client
+from uploader import DocumentUploader
+
+_BUCKET = 'inquests-ca-test'
+
+
+@pytest.fixture
+def s3_session(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        session = boto3.Session(region_name='us-east-1')
+        session.client('s3').create_bucket(Bucket=_BUCKET)
+        yield session
+
+
+@pytest.fixture
+def document_file(tmp_path):
+    path = tmp_path / 'document.pdf'
+    path.write_bytes(b'%PDF-1.4 test')
+    stat_result = path.stat()
+    return DocumentFile(str(path), stat_result.st_size, stat_result.st_mtime_ns)
+
+
+def _fail_put_object(s3_session, failure_count):
+    """Make the next given number of PutObject requests fail; returns list of attempted requests."""
+    attempts = []
+
+    def before_put_object(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) <= failure_count:
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'InternalError', 'Message': ''}}, 'PutObject')
+
+    s3_session.events.register('before-call.s3.PutObject', before_put_object)
+    return attempts
+
+
+def _upload(s3_session, document_file):
+    manifest = UploadManifest(':memory:')
+    document_uploader = DocumentUploader(S3Client(_BUCKET, session=s3_session), manifest, max_workers=1)
+    document_uploader.submit('DOC1', document_file, 'Documents/document.pdf')
+    return document_uploader.wait()
+
+
+def test_failed_put_object_is_retried(s3_session, document_file, monkeypatch):
+    delays = []
+    monkeypatch.setattr(uploader.time, 'sleep', delays.append)
+    attempts = _fail_put_object(s3_session, failure_count=1)
+
+    failures = _upload(s3_session, document_file)
+
+    assert failures == []
+    assert len(attempts) == 2
+    assert delays == [1]
+    s3_session.client('s3').head_object(Bucket=_BUCKET, Key='Documents/document.pdf')
+
+
+def test_upload_fails_after_all_attempts(s3_session, document_file, monkeypatch):
+    delays = []
+    monkeypatch.setattr(uploader.time, 'sleep', delays.append)
+    attempts = _fail_put_object(s3_session, failure_count=5)
+
+    failures = _upload(s3_session, document_file)
+
+    assert len(failures) == 1
+    assert isinstance(failures[0][2], boto3.exceptions.S3UploadFailedError)
+    assert len(attempts) == 5
+    assert delays == [1, 2, 4, 8]
+
+
+def test_cancel_skips_queued_uploads(s3_session, tmp_path):
+    started = threading.Event()
+    released = threading.Event()
+    attempts = []
+
+    def before_put_object(**kwargs):
+        attempts.append(kwargs)
+        started.set()
+        released.wait(timeout=10)
+
+    s3_session.events.register('before-call.s3.PutObject', before_put_object)
+
+    manifest = UploadManifest(':memory:')
+    document_uploader = DocumentUploader(S3Client(_BUCKET, session=s3_session), manifest, max_workers=1)
+    for index in range(5):
+        path = tmp_path / 'document{}.pdf'.format(index)
+        path.write_bytes(b'%PDF-1.4 test')
+        stat_result = path.stat()
+        document_file = DocumentFile(str(path), stat_result.st_size, stat_result.st_mtime_ns)
+        document_uploader.submit('DOC{}'.format(index), document_file, 'Documents/document{}.pdf'.format(index))
+
+    # Release the upload in progress only once the others are cancelled.
+    assert started.wait(timeout=10)
+    timer = threading.Timer(0.2, released.set)
+    timer.start()
+    document_uploader.cancel()
+    timer.join()
+
+    assert len(attempts) == 1
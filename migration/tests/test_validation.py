@@ -0,0 +1,68 @@
+import collections
+
+import sqlalchemy
+
+import models
+from validation import RULES, MemoryValidator, Validator
+
+_ROWS = [
+    (models.Authority, {'authorityId': 1}),
+    (models.Authority, {'authorityId': 2}),
+    (models.AuthorityKeyword, {'authorityKeywordId': 'FACTOR_ALCOHOL'}),
+    (models.AuthorityKeyword, {'authorityKeywordId': 'FACTOR_UNUSED'}),
+    (models.AuthorityKeywords, {'authorityId': 1, 'authorityKeywordId': 'FACTOR_ALCOHOL'}),
+    (models.AuthorityDocument, {'authorityDocumentId': 1, 'authorityId': 1, 'isPrimary': True}),
+    (models.AuthorityDocument, {'authorityDocumentId': 2, 'authorityId': 2, 'isPrimary': True}),
+    (models.AuthorityDocument, {'authorityDocumentId': 3, 'authorityId': 2, 'isPrimary': True}),
+    (models.Inquest, {'inquestId': 1}),
+    (models.InquestDocument, {'inquestDocumentId': 1, 'inquestId': 1}),
+]
+
+
+def _validate_in_database(rows, labels, caplog):
+    engine = sqlalchemy.create_engine('sqlite://')
+    tables = collections.defaultdict(set)
+    for model, values in rows:
+        tables[model.__tablename__].update(values)
+    for rule in RULES:
+        tables[rule.table].add(rule.key_column)
+        tables[rule.count_table].update([rule.count_column] + [column for column, _ in rule.count_values])
+
+    for table, columns in tables.items():
+        engine.execute('CREATE TABLE {} ({})'.format(table, ', '.join(sorted(columns))))
+    for model, values in rows:
+        engine.execute(
+            sqlalchemy.text('INSERT INTO {} ({}) VALUES ({})'.format(
+                model.__tablename__, ', '.join(values), ', '.join(':' + column for column in values)
+            )),
+            values
+        )
+
+    caplog.clear()
+    violation_count = Validator(RULES).validate(engine, labels)
+    return violation_count, [record.getMessage() for record in caplog.records]
+
+
+def _validate_in_memory(rows, labels, caplog):
+    validator = MemoryValidator(RULES)
+    for model, values in rows:
+        validator.add(model, **values)
+    validator.flush()
+
+    caplog.clear()
+    violation_count = validator.validate(labels)
+    return violation_count, [record.getMessage() for record in caplog.records]
+
+
+def test_memory_validator_reports_same_violations_as_database(caplog):
+    labels = {'authority': {1: 'A1', 2: 'A2'}, 'inquest': {1: 'I1'}}
+
+    in_memory = _validate_in_memory(_ROWS, labels, caplog)
+
+    assert in_memory == _validate_in_database(_ROWS, labels, caplog)
+    assert in_memory == (4, [
+        'Authority: A2 has 2 primary documents.',
+        'Authority: A2 does not have any keywords.',
+        'Inquest: I1 does not have any keywords.',
+        'Authority keyword: FACTOR_UNUSED is not used by any authority.',
+    ])
@@ -0,0 +1,139 @@
+import datetime
+import gc
+import os
+import re
+
+import pymysql.converters
+import pytest
+
+import models
+from writer import InfileWriter
+
+_VALUES = [
+    None,
+    True,
+    False,
+    0,
+    1234,
+    datetime.datetime(2020, 1, 2, 3, 4, 5),
+    datetime.datetime(2020, 1, 2, 3, 4, 5, 678),
+    '',
+    'Fall from height',
+    'tab\tnewline\nreturn\rbackslash\\nul\0end',
+    '\\N',
+    '\\\\t',
+    'quotes \' and "',
+]
+
+# Escape sequences of MySQL string literals, and of fields loaded with ESCAPED BY '\\'.
+_LITERAL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def _unescape(string):
+    return re.sub(r'\\(.)', lambda match: _LITERAL_ESCAPES.get(match.group(1), match.group(1)), string, flags=re.S)
+
+
+def _parse_sql_literal(literal):
+    """Returns value MySQL stores for given literal."""
+    if literal == 'NULL':
+        return None
+    if literal.startswith("'"):
+        return _unescape(literal[1:-1])
+    return literal
+
+
+def _parse_tsv_field(field):
+    """Returns value MySQL stores for given field of a file loaded by InfileWriter."""
+    assert not re.search(r'[\t\n]', field)
+    if field == '\\N':
+        return None
+    return _unescape(field)
+
+
+class _LoadingSession:
+    """
+    Session which records statements, reports given number of rows loaded by each LOAD DATA statement and reports
+    given warnings for each load.
+    """
+
+    def __init__(self, loaded_row_count, warnings=()):
+        self.statements = []
+        self._loaded_row_count = loaded_row_count
+        self._warnings = [('Warning', 1265, message) for message in warnings]
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(str(statement))
+        if str(statement) == 'SHOW COUNT(*) WARNINGS':
+            return _Result(rows=[(len(self._warnings),)])
+        if str(statement).startswith('SHOW WARNINGS'):
+            return _Result(rows=self._warnings)
+        return _Result(rowcount=self._loaded_row_count)
+
+
+class _Result:
+
+    def __init__(self, rowcount=-1, rows=()):
+        self.rowcount = rowcount
+        self._rows = list(rows)
+
+    def scalar(self):
+        return self._rows[0][0]
+
+    def fetchall(self):
+        return self._rows
+
+
+@pytest.mark.parametrize('value', _VALUES)
+def test_format_value_stores_same_value_as_driver(value):
+    writer = InfileWriter(_LoadingSession(0))
+
+    field = writer._format_value(value)
+
+    assert _parse_tsv_field(field) == _parse_sql_literal(pymysql.converters.escape_item(value, 'utf8'))
+
+
+def test_flush_loads_spooled_rows():
+    session = _LoadingSession(2)
+    writer = InfileWriter(session)
+    writer.add(models.AuthorityTags, authorityId=1, tag='police')
+    writer.add(models.AuthorityTags, authorityId=1, tag='youth')
+
+    writer.flush()
+
+    assert any('LOAD DATA LOCAL INFILE' in statement for statement in session.statements)
+    assert session.statements[-2:] == ['SET UNIQUE_CHECKS = 1', 'SET FOREIGN_KEY_CHECKS = 1']
+
+
+def test_flush_raises_when_rows_are_skipped():
+    # LOAD DATA LOCAL skips rows with duplicate keys instead of failing.
+    session = _LoadingSession(1)
+    writer = InfileWriter(session)
+    writer.add(models.AuthorityTags, authorityId=1, tag='police')
+    writer.add(models.AuthorityTags, authorityId=1, tag='police')
+
+    with pytest.raises(RuntimeError, match='loaded 1 of 2 rows'):
+        writer.flush()
+
+    assert session.statements[-2:] == ['SET UNIQUE_CHECKS = 1', 'SET FOREIGN_KEY_CHECKS = 1']
+
+
+def test_flush_raises_when_values_are_converted():
+    # LOAD DATA LOCAL truncates or coerces invalid values with a warning instead of failing.
+    session = _LoadingSession(1, warnings=["Data truncated for column 'tag' at row 1"])
+    writer = InfileWriter(session)
+    writer.add(models.AuthorityTags, authorityId=1, tag='x' * 1000)
+
+    with pytest.raises(RuntimeError, match="1 warnings, including: Data truncated for column 'tag'"):
+        writer.flush()
+
+
+def test_spool_files_are_removed_without_flush():
+    writer = InfileWriter(_LoadingSession(0))
+    writer.add(models.AuthorityTags, authorityId=1, tag='police')
+    spool_directory = writer._spool_directory
+    assert os.listdir(spool_directory) == ['authorityTags.tsv']
+
+    del writer
+    gc.collect()
+
+    assert not os.path.exists(spool_directory)